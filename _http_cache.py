@@ -0,0 +1,77 @@
+import json
+import os
+import threading
+from contextlib import nullcontext
+from logging import getLogger
+from pathlib import Path
+
+import requests
+
+logger = getLogger("root")
+
+
+# Send a GET request cached on disk
+def cached_get(session: requests.Session, url: str, body_file: Path, validators_file: Path, slot=None, **kwargs) -> bytes:
+    """
+        Send a GET request and keep its body on disk. Responses with an ETag or
+        Last-Modified header are stored in body_file and validators_file, and later
+        requested conditionally, so an unchanged resource is answered with 304 and
+        read from body_file instead.
+
+        Parameters
+        -----------
+        session : requests.Session
+            The session to send the request with.
+        url : str
+            The URL to request.
+        body_file : Path
+            File holding the cached body.
+        validators_file : Path
+            File holding the validators of the cached body.
+        slot : context manager, optional
+            Held while the request is sent, e.g. a semaphore limiting the open connections.
+        **kwargs
+            Further arguments to session.get, such as params and timeout.
+
+        Returns
+        -----------
+        The body of the response, or of the cached response if it is unchanged.
+
+        Raises
+        -----------
+        requests.HTTPError
+            If the response has an error status.
+    """
+    headers = {}
+    if body_file.exists() and validators_file.exists():
+        try:
+            validators = json.loads(validators_file.read_text())
+        except (OSError, ValueError) as e:
+            # An unreadable cache entry only means the request cannot be conditional
+            logger.warning(f"Ignoring unreadable cache validators {validators_file}: {e}")
+            validators = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    with slot or nullcontext():
+        response = session.get(url, headers=headers, **kwargs)
+    logger.debug(f"{url} received with content encoding: {response.headers.get('Content-Encoding')}")
+
+    if response.status_code == 304 and headers:
+        logger.info(f"{url} is unchanged, using cached response")
+        return body_file.read_bytes()
+
+    response.raise_for_status()
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if response.status_code == 200 and (etag or last_modified):
+        os.makedirs(body_file.parent, exist_ok=True)
+        # Write to a temporary file first so concurrent readers never see a partial entry
+        tmp_file = body_file.with_name(f"{body_file.name}.{threading.get_ident()}.tmp")
+        tmp_file.write_bytes(response.content)
+        os.replace(tmp_file, body_file)
+        tmp_file.write_text(json.dumps({"etag": etag, "last_modified": last_modified}))
+        os.replace(tmp_file, validators_file)
+    return response.content
@@ -1,24 +1,24 @@
-import logging
 import xml.etree.ElementTree as ET
 import pandas as pd
 from dataio.config import Config
-from ._utilities import save_request, xml2csv_metadata, unzip_files, getLogger
+from ._utilities import getLogger
+from ._http_cache import cached_get
 from time import time
+from functools import partial
 import os
 from zipfile import ZipFile, ZIP_DEFLATED
 import json
 import io
 from xml.dom.minidom import parseString
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG,
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                    handlers=[
-                        logging.FileHandler("eurostat_waste.log"),
-                        logging.StreamHandler()
-                    ])
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import hashlib
+import gzip
+import shutil
 
 # Global variables
 logger = getLogger("root")
@@ -27,6 +27,39 @@ datasets = ['ENPS_ENV_WASGENH', 'ENPS_ENV_WASGENM', 'ENPS_ENV_WASTRT', 'ENPS_ENV
             'ENV_WASELV', 'ENV_WASELVT', 'ENV_WASFLOW', 'ENV_WASFW', 'ENV_WASGEN', 'ENV_WASMUN', 'ENV_WASOPER', 'ENV_WASPAC', 'ENV_WASPACR', 'ENV_WASPB', 
             'ENV_WASPCB', 'ENV_WASSHIP', 'ENV_WASTRDMP', 'ENV_WASTRT', 'ENV_WW_SPD']
 metadata_types = ['dataflow', 'codelist', 'conceptscheme']
+# Query parameters of each catalogue, only the concept schemes are requested in English.
+params_by_type = {'dataflow': {"lang": None, "detail": "allstubs", "completestub": "true"},
+                  'codelist': {"lang": None, "detail": "allstubs", "completestub": "true"},
+                  'conceptscheme': {"lang": "en", "detail": "allstubs", "completestub": "true"}}
+NS = {"m": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message",
+      "s": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure",
+      "c": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/common",
+      "xml": "http://www.w3.org/XML/1998/namespace"}
+enumeration_tag = f"{{{NS['s']}}}Enumeration"
+prepared_tag = f"{{{NS['m']}}}Prepared"
+lang_attribute = f"{{{NS['xml']}}}lang"
+max_workers = 8
+max_connections = 8
+max_retries = 5
+request_timeout = 30
+chunk_size = 1 << 20
+# Metadata responses are kept here and revalidated with conditional requests.
+cache_dir = os.environ.get('EUROSTAT_CACHE_DIR', 'eurostat_cache')
+# Prettifying is only useful for human inspection, so it is opt-in.
+prettify_xml = bool(os.environ.get('EUROSTAT_PRETTY'))
+
+# Makes concurrent workers wait for a catalogue download already in progress.
+catalog_lock = threading.Lock()
+# Caps the number of simultaneous requests to ec.europa.eu to stay below its rate limit.
+connection_slots = threading.BoundedSemaphore(max_connections)
+# Shared session so connections to ec.europa.eu are kept alive between requests.
+# Throttled and failed responses are retried with exponential backoff.
+session = requests.Session()
+session.mount('https://', HTTPAdapter(
+    pool_maxsize=max_connections,
+    max_retries=Retry(total=max_retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)))
+# Catalogue of each metadata type as a dict keyed by id, downloaded once per run.
+catalogs = {}
 
 
 # Prettify xml data
@@ -68,7 +101,7 @@ def prettify_data(data: str, file_extension: str) -> str:
 # Save prettified xml to zip
 def save_prettified_xml_to_zip(xml_data: str, output_zip_path: str, xml_filename: str) -> None:
     """
-        Save prettified XML data to a zip file.
+        Save XML data to a zip file, prettified if EUROSTAT_PRETTY is set.
 
         Parameters
         -------------
@@ -85,53 +118,127 @@ def save_prettified_xml_to_zip(xml_data: str, output_zip_path: str, xml_filename
     """
     try:
         # Prettify the XML data
-        prettified_xml = prettify_data(xml_data, ".xml")
+        if prettify_xml:
+            xml_data = prettify_data(xml_data, ".xml")
         
-        # Create a zip file and add the prettified XML
+        # Create a zip file and add the XML
         with ZipFile(output_zip_path, 'w', ZIP_DEFLATED) as zip_file:
-            zip_file.writestr(xml_filename, prettified_xml)
+            zip_file.writestr(xml_filename, xml_data)
         
-        logger.info(f"Prettified XML saved to {output_zip_path} as {xml_filename}")
+        logger.info(f"XML saved to {output_zip_path} as {xml_filename}")
     except Exception as e:
-        logger.error(f"Failed to save prettified XML to zip: {e}")
+        logger.error(f"Failed to save XML to zip: {e}")
 
         
-# Get dataset information
-def get_datasets_info(metadata_type: str, save_dir: str):
-    params = {"lang": "en", "detail": "allstubs", "completestub": "true"}
-    if metadata_type in ['dataflow', 'codelist']:
-        params["lang"] = None
-    else:
-        params["lang"] = "en"
+# Send a throttled GET request
+def request_get(url: str, params: dict) -> bytes:
+    """
+        Send a GET request through the shared session while holding one of the
+        connection slots. The response is cached in cache_dir by cached_get, so an
+        unchanged resource is read from the cache instead.
+
+        Parameters
+        -----------
+        url : str
+            The URL to request.
+        params : dict
+            Query parameters of the request.
+
+        Returns
+        -----------
+        The body of the response.
 
+        Raises
+        -----------
+        requests.HTTPError
+            If the last attempt has an error status.
+    """
+    key = hashlib.sha1(f"{url} {sorted(params.items())}".encode()).hexdigest()
+    return cached_get(session, url, Path(cache_dir) / f"{key}.body", Path(cache_dir) / f"{key}.json",
+                      slot=connection_slots, params=params, timeout=request_timeout)
+
+
+# Fetch dataset information
+def fetch_datasets_info(metadata_type: str) -> bytes:
+    """
+        Download the catalogue of a metadata type from the Eurostat API.
+
+        Parameters
+        -----------
+        metadata_type : str
+            Type of metadata catalogue, e.g. "dataflow", "codelist" or "conceptscheme".
+
+        Returns
+        -----------
+        The catalogue as XML bytes.
+    """
+    params = params_by_type[metadata_type]
     logger.info(f"Get {metadata_type}")
     t1 = time()
     url = f"{base_url}{metadata_type}/ESTAT/all"
-    
+
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()  # This will raise an HTTPError for bad responses
-        data = response.content
+        content = request_get(url, params=params)
     except requests.RequestException as e:
         logger.error(f"Failed to fetch data from {url}: {e}")
+        raise
+    finally:
         logger.info(f"Got {metadata_type} in {time() - t1:.2f}s")
-        raise  # Ensure that we return here so that file saving and xml2csv_metadata are not called
+    return content
 
-    prettified_data = prettify_data(data, '.xml')
 
-    # Save prettified data to file
-    try:
-        # Ensure the directory exists before saving the file
-        os.makedirs(save_dir, exist_ok=True)
-        with open(f'{save_dir}/{metadata_type}.xml', 'w', encoding='utf-8') as file:
-            file.write(prettified_data)
-        logger.info(f"Data has been prettified and saved to {save_dir}.")
-    except Exception as e:
-        logger.error(f"Failed to save data to file {save_dir}: {e}")
-        logger.info(f"Got {metadata_type} in {time() - t1:.2f}s")
-        return  # Ensure that we return here so that xml2csv_metadata is not called on failure
+# Read metadata catalogue
+def xml2df_metadata(content: bytes, metadata_type: str) -> pd.DataFrame:
+    """
+        Build a table of the catalogue entries of a metadata type while parsing its XML.
+        Every entry holds its attributes, e.g. "id" and "structureURL", and its English "name".
+
+        Parameters
+        -----------
+        content : bytes
+            The catalogue XML.
+        metadata_type : str
+            Type of metadata catalogue, e.g. "dataflow", "codelist" or "conceptscheme".
+
+        Returns
+        -----------
+        DataFrame with one row per catalogue entry.
+    """
+    records = []
+    for _, item in ET.iterparse(io.BytesIO(content)):
+        if "structureURL" not in item.attrib:
+            continue
+        names = {name.get(lang_attribute): name.text for name in item.findall('c:Name', NS)}
+        records.append({**item.attrib, "name": names.get("en", next(iter(names.values()), None))})
+        item.clear()
+
+    logger.info(f"Read {len(records)} {metadata_type} entries")
+    if not records:
+        return pd.DataFrame(columns=["id", "structureURL", "name"])
+    return pd.DataFrame.from_records(records)
+
+
+# Load metadata catalogue
+def load_catalog(metadata_type: str) -> dict:
+    '''
+        Retrieve the catalogue of a metadata type, downloading it only the first time
+        it is requested during a run.
+
+        Parameters
+        ----------
+        metadata_type : str
+            Type of metadata catalogue, e.g. "dataflow", "codelist" or "conceptscheme".
+
+        Returns
+        ----------
+        Dict mapping each id to its catalogue entry, e.g. its "structureURL".
+    '''
+    with catalog_lock:
+        if metadata_type not in catalogs:
+            df = xml2df_metadata(fetch_datasets_info(metadata_type), metadata_type)
+            catalogs[metadata_type] = df.drop_duplicates(subset='id').set_index('id').to_dict('index')
+        return catalogs[metadata_type]
 
-    xml2csv_metadata(save_dir, save_dir, metadata_type)
 
 # Download metadata
 def get_metadata(id: str, metadata_type: str, save_dir: str):
@@ -158,34 +265,93 @@ def get_metadata(id: str, metadata_type: str, save_dir: str):
 
     try:
         os.makedirs(save_dir, exist_ok=True)
-        # Read the CSV into a DataFrame
-        get_datasets_info(metadata_type, '.')
-        df = pd.read_csv(f'{metadata_type}.csv')
-        os.remove(f'{metadata_type}.csv')
-        os.remove(f'{metadata_type}.xml')
-
-        # Filter the row corresponding to the id
-        row = df[df["id"] == id]
+        entry = load_catalog(metadata_type).get(id)
 
         # If no matching row is found, log a message and exit
-        if len(row) == 0:
+        if entry is None:
             logger.warning(f"No {metadata_type} found for id {id} in the CSV.")
             return
 
         # Extract the structure URL from the row
-        url = row["structureURL"].values[0]
+        url = entry["structureURL"]
 
-        response = requests.get(url, params={})        
+        content = request_get(url, params={})
         zip_filename = f"dim_{id}.zip"
         zip_filepath = Path(save_dir) / zip_filename
         xml_filename = f"dim_{id}.xml"
-        save_prettified_xml_to_zip(response.content, zip_filepath, xml_filename)
+        save_prettified_xml_to_zip(content, zip_filepath, xml_filename)
 
         logger.info(f"Successfully saved {metadata_type} for {id} to {save_dir}")
 
     except Exception as e:
         logger.error(f"An error occurred during the {metadata_type} request process: {e}")
 
+# Get the concept scheme structure of a dataset
+def fetch_concept_xml(dataset: str) -> bytes:
+    '''
+        Retrieve the concept scheme structure of a dataset.
+
+        Parameters
+        ----------
+        dataset : str
+            The dataset wanting to retrieve the structure from.
+
+        Returns 
+        ----------
+        The structure XML as bytes.
+    '''
+    entry = load_catalog('conceptscheme').get(dataset)
+    if entry is None:
+        logger.error(f"No conceptscheme found for id {dataset}")
+        raise KeyError(dataset)
+
+    return request_get(entry['structureURL'], params={})
+
+
+# Read data version from structure
+def parse_data_version(content: bytes) -> str:
+    '''
+        Read the data version from the Prepared timestamp in the header of a
+        structure XML. Parsing stops as soon as the header element is found.
+
+        Parameters
+        ----------
+        content : bytes
+            The structure XML.
+
+        Returns 
+        ----------
+        String with data version in format "YYYYMMDD", or None if the header has no timestamp.
+    '''
+    for _, elem in ET.iterparse(io.BytesIO(content)):
+        if elem.tag == prepared_tag:
+            return elem.text.split('T')[0].replace('-','') if elem.text else None
+    return None
+
+
+# Read columns from structure
+def parse_data_columns(content: bytes) -> list:
+    '''
+        Read the ids of the enumerated columns from a structure XML. The XML is
+        streamed and every enumeration is released once its id has been read.
+
+        Parameters
+        ----------
+        content : bytes
+            The structure XML.
+
+        Returns 
+        ----------
+        List of data columns.
+    '''
+    ids = []
+    for _, item in ET.iterparse(io.BytesIO(content)):
+        if item.tag == enumeration_tag:
+            ids.append(item[0].get('id'))
+            item.clear()
+    return ids
+
+
 # Get data version
 def get_data_version(dataset: str):
     '''
@@ -200,13 +366,7 @@ def get_data_version(dataset: str):
         ----------
         String with data version in format "YYYYMMDD".
     '''
-    get_metadata(dataset, 'conceptscheme', '.')
-    unzip_files('.')
-    root = ET.parse(f'dim_{dataset}.xml').getroot()
-    version = (root[0][2].text).split('T')[0].replace('-','')
-    os.remove(f'dim_{dataset}.xml')
-    os.remove(f'dim_{dataset}.zip')
-    return version
+    return parse_data_version(fetch_concept_xml(dataset))
 
 
 # Get columns in dataset
@@ -223,19 +383,27 @@ def get_data_columns(dataset: str):
         ----------
         List of data columns.
     '''
-    get_metadata(dataset, 'conceptscheme', '.')
-    unzip_files('.')
-    root = ET.parse(f'dim_{dataset}.xml').getroot()
-    NS = {"m": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message",
-          "s": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure",
-          "c": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/common",
-          "xml": "http://www.w3.org/XML/1998/namespace"}
-    ids = []
-    for item in root.findall(f".//s:Enumeration", NS):
-        ids.append(item[0].get('id'))
-    os.remove(f'dim_{dataset}.xml')
-    os.remove(f'dim_{dataset}.zip')
-    return ids
+    return parse_data_columns(fetch_concept_xml(dataset))
+
+
+# Get data version and columns in dataset
+def get_data_structure(dataset: str) -> tuple:
+    '''
+        Retrieve both the data version and the columns of a dataset from a single
+        download of its structure.
+
+        Parameters
+        ----------
+        dataset : str
+            The dataset wanting to retrieve the structure from.
+
+        Returns 
+        ----------
+        Tuple with the data version and the list of data columns.
+    '''
+    content = fetch_concept_xml(dataset)
+    return parse_data_version(content), parse_data_columns(content)
+
 
 # Get dataset description
 def get_data_description(dataset: str):
@@ -251,17 +419,44 @@ def get_data_description(dataset: str):
         ------------
         String with the dataset description.
     '''
-    get_datasets_info('dataflow', '.')
-    df = pd.read_csv('dataflow.csv')
-    filtered_df = df[df['id'] == dataset]
-    os.remove('dataflow.csv')
-    os.remove('dataflow.xml')
-    return filtered_df['name'].to_string(index=False)
+    entry = load_catalog('dataflow').get(dataset)
+    if entry is None:
+        return ''
+    return str(entry['name'])
+
+# Download all metadata of a dataset
+def get_dataset_metadata(dataset: str, code_list: list, save_dir: str):
+    '''
+        Retrieve and save every metadata type for a dataset. The codelists of the
+        dataset are downloaded concurrently.
+
+        Parameters
+        ----------
+        dataset : str
+            The dataset wanting to retrieve metadata for.
+        code_list : list
+            The ids of the codelists used by the dataset.
+        save_dir : str
+            Directory where the metadata should be saved.
+
+        Returns 
+        ----------
+        None
+    '''
+    for metadata in metadata_types:
+        if metadata == 'codelist':
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(partial(get_metadata, metadata_type=metadata, save_dir=save_dir), code_list))
+        else:
+            get_metadata(dataset, metadata, save_dir)
+
 
 # Download/update data
 def get_data(dataset: str, save_dir: str):
     '''
         Retrieve and save data for a given dataset in zipped CSV format.
+        The download is streamed to disk and moved into the zip archive in chunks,
+        so memory use does not depend on the size of the dataset.
 
         Parameters
         ----------
@@ -274,77 +469,136 @@ def get_data(dataset: str, save_dir: str):
         ----------
         None
     '''
-    save_request(
-        url=f"{base_url}data/{dataset}/?format=SDMX-CSV&compressed=true&i",
-        params={},
-        path=save_dir,
-        file_stem=dataset,
-        create_path=True,
-        overwrite=True,
-        want_zip = True)
+    os.makedirs(save_dir, exist_ok=True)
+    url = f"{base_url}data/{dataset}/?format=SDMX-CSV&compressed=true&i"
+    download_path = Path(save_dir) / f"{dataset}.download"
+
+    # The payload is already gzip compressed, so ask for it without transfer encoding
+    with connection_slots:
+        with session.get(url, stream=True, timeout=request_timeout, headers={"Accept-Encoding": "identity"}) as response:
+            response.raise_for_status()
+            with open(download_path, 'wb') as file:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    file.write(chunk)
+
+    with open(download_path, 'rb') as file:
+        is_gzip = file.read(2) == b'\x1f\x8b'
+    with (gzip.open(download_path) if is_gzip else open(download_path, 'rb')) as source:
+        with ZipFile(Path(save_dir) / f"{dataset}.zip", 'w', ZIP_DEFLATED) as zip_file:
+            with zip_file.open(f"{dataset}.csv", 'w') as target:
+                shutil.copyfileobj(source, target, chunk_size)
+    os.remove(download_path)
+
+    logger.info(f"Data for {dataset} saved to {save_dir}")
+
+
+# Create the resource of a dataset
+def create_resource(config: Config, dataset: str):
+    '''
+        Create the resource describing a dataset in the resource repository.
+
+        Parameters
+        ----------
+        config : Config
+            Configuration holding the resource schemas.
+        dataset : str
+            The dataset the resource describes.
+
+        Returns
+        ----------
+        The DataResource of the dataset.
+    '''
+    resource = config.schemas.DataResource(
+        name=f'eurostat_waste_{dataset}',
+        schema_name="None",
+        location="", 
+        task_name="eurostat_waste_collect",
+        stage="collect",
+        data_flow_direction='output',
+        data_version="00000000",
+        code_version="0.0.0",
+        comment=f"Waste data and metadata collected from eurostat for dataset {dataset}",
+        created_by="Albert K. Osei-Owusu",
+        license="Open Data Commons Public Domain Dedication (CC-BY 4.0)",
+        license_url="https://creativecommons.org/licenses/by-sa/4.0/legalcode",
+        description="",
+        url=""
+    )
+
+    resource.location = f"collect/eurostat/{dataset}/{resource.data_version}"
+    return resource
+
+
+# Collect a single dataset
+def process_dataset(resource, dataset: str, online_version: str, code_list: list):
+    '''
+        Download the data and metadata of a dataset and fill in its resource.
+
+        Parameters
+        ----------
+        resource : DataResource
+            The resource of the dataset.
+        dataset : str
+            The dataset to collect.
+        online_version : str
+            The version of the dataset currently published by Eurostat.
+        code_list : list
+            The ids of the codelists used by the dataset.
+
+        Returns
+        ----------
+        The updated DataResource of the dataset.
+    '''
+    if online_version:
+        resource.data_version = online_version
+    else:
+        resource.data_version = "00000000"
+    get_data(dataset, resource.location)
+    resource.description = get_data_description(dataset)
+    get_dataset_metadata(dataset, code_list, f'{resource.location}/metadata')
+    return resource
 
 
 def eurostat_collect(config: Config) -> bool:
     '''
         Add or update the data collected in Sharepoint as well as update the resources file.
+        The versions of all datasets are checked first, after which only the outdated
+        datasets are downloaded. Both steps run concurrently since they are bound by the
+        Eurostat API. The resources file is updated once all downloads have finished.
     '''
+    catalogs.clear()
     repo = config.resource_repository
-    did_update = False
-
-    for dataset in datasets:
-        resource = config.schemas.DataResource(
-            name=f'eurostat_waste_{dataset}',
-            schema_name="None",
-            location="", 
-            task_name="eurostat_waste_collect",
-            stage="collect",
-            data_flow_direction='output',
-            data_version="00000000",
-            code_version="0.0.0",
-            comment=f"Waste data and metadata collected from eurostat for dataset {dataset}",
-            created_by="Albert K. Osei-Owusu",
-            license="Open Data Commons Public Domain Dedication (CC-BY 4.0)",
-            license_url="https://creativecommons.org/licenses/by-sa/4.0/legalcode",
-            description="",
-            url=""
-        )
-
-        resource.location = f"collect/eurostat/{dataset}/{resource.data_version}"
-
-        online_version = get_data_version(dataset)
-        code_list = get_data_columns(dataset)
-        data_description = get_data_description(dataset)
 
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        structure_futures = [(dataset, executor.submit(get_data_structure, dataset)) for dataset in datasets]
+
+        outdated = []
+        for dataset, future in structure_futures:
+            # A dataset whose structure cannot be read is skipped, the others are still checked
+            try:
+                online_version, code_list = future.result()
+            except Exception as e:
+                logger.error(f"Failed to get the structure of dataset {dataset}: {e}")
+                continue
+            resource = create_resource(config, dataset)
+            try:
+                latest_version = repo.get_latest_version(name=resource.name, stage=resource.stage, task_name=resource.task_name)
+            except:
+                latest_version = None
+            if latest_version and latest_version == online_version:
+                continue
+            outdated.append((resource, dataset, online_version, code_list))
+
+        futures = [(args[1], executor.submit(process_dataset, *args)) for args in outdated]
+
+    # A failed dataset must not keep the datasets that did download from being registered
+    updated = []
+    for dataset, future in futures:
         try:
-            latest_version = repo.get_latest_version(name=resource.name, stage=resource.stage, task_name=resource.task_name)
-        except:
-            latest_version = None
-        if latest_version:
-            if latest_version != online_version:
-                resource.data_version = online_version
-                get_data(dataset, resource.location)
-                resource.description = data_description
-                for metadata in metadata_types:
-                    if metadata == 'codelist':
-                        for id in code_list:
-                            get_metadata(id, metadata, f'{resource.location}/metadata')
-                    else:
-                        get_metadata(dataset, metadata, f'{resource.location}/metadata')
-                repo.add_or_update_resource_list(resource)
-                did_update = True
-        else:
-            if online_version:
-                resource.data_version = online_version
-            else:
-                resource.data_version = "00000000"
-            get_data(dataset, resource.location)
-            resource.description = data_description
-            for metadata in metadata_types:
-                    if metadata == 'codelist':
-                        for id in code_list:
-                            get_metadata(id, metadata, f'{resource.location}/metadata')
-                    else:
-                        get_metadata(dataset, metadata, f'{resource.location}/metadata')
-            repo.add_or_update_resource_list(resource)
-            did_update = True
-    return did_update
+            updated.append(future.result())
+        except Exception as e:
+            logger.error(f"Failed to collect dataset {dataset}: {e}")
+
+    for resource in updated:
+        repo.add_or_update_resource_list(resource)
+    return len(updated) > 0
@@ -1,31 +1,61 @@
-import logging
 import xml.etree.ElementTree as ET
+# lxml parses SDMX considerably faster, but the collectors do not depend on it
+try:
+    from lxml import etree
+except ImportError:
+    etree = ET
 import pandas as pd
-from ._utilities import save_request, xml2csv_metadata, unzip_files, getLogger
+from ._utilities import save_request, getLogger
 from time import time
+from functools import lru_cache
 import os
-from zipfile import ZipFile, ZIP_DEFLATED
+from zipfile import ZipFile, ZIP_STORED
 import json
 import io
-from xml.dom.minidom import parseString
+import tempfile
 import requests
+from requests.adapters import HTTPAdapter
 from pathlib import Path
+from email.utils import parsedate_to_datetime
 from dataio.config import Config
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG,
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                    handlers=[
-                        logging.FileHandler("eurostat_waste.log"),
-                        logging.StreamHandler()
-                    ])
-
+from concurrent.futures import ThreadPoolExecutor
+import threading
 
 # Global variables
 logger = getLogger("root")
 base_url = 'https://ec.europa.eu/eurostat/api/comext/dissemination/sdmx/2.1/'
 datasets= ['DS-056121', 'DS-056120']
 metadata_types = ["dataflow", 'codelist', 'conceptscheme']
+max_workers = 4
+chunk_size = 1 << 20
+# Seconds to wait for the server before a request fails, instead of hanging a worker
+request_timeout = 30
+# Structures larger than this are spooled to disk instead of being kept in memory
+spool_size = 16 << 20
+# Prettifying is only useful for human inspection, so it is opt-in.
+prettify_xml = bool(os.environ.get('PRODCOM_PRETTY'))
+# Shared session so connections to ec.europa.eu are kept alive between requests
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=8, pool_maxsize=16))
+session.headers.update({"Accept-Encoding": "gzip"})
+# Rows of each metadata catalogue keyed by id, downloaded once per run
+datasets_info = {}
+# Structure URL of each id per metadata type, built once per run
+structure_urls = {}
+# Makes concurrent workers wait for a catalogue download already in progress
+catalog_lock = threading.RLock()
+NS = {"m": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message",
+      "s": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure",
+      "c": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/common",
+      "xml": "http://www.w3.org/XML/1998/namespace"}
+header_tag = f"{{{NS['m']}}}Header"
+enumeration_tag = f"{{{NS['s']}}}Enumeration"
+lang_attribute = f"{{{NS['xml']}}}lang"
+
+# Keep the SDMX prefixes when prettified XML is serialised again
+for prefix, uri in NS.items():
+    if prefix != "xml":
+        ET.register_namespace(prefix, uri)
 
 
 # Prettify xml data
@@ -49,9 +79,11 @@ def prettify_data(data: str, file_extension: str) -> str:
         return json.dumps(json.loads(data), indent=4)
     elif file_extension == ".xml":
         try:
-            dom = parseString(data)
-            return dom.toprettyxml(indent="  ")
-        except Exception as e:
+            # ET parsers cannot be fed again once closed, so each call gets its own
+            root = ET.fromstring(data)
+            ET.indent(root, space="  ")
+            return ET.tostring(root, encoding="unicode", xml_declaration=True)
+        except ET.ParseError as e:
             logger.error(f"Failed to prettify XML: {e}")
             return data
     elif file_extension == ".csv":
@@ -65,9 +97,9 @@ def prettify_data(data: str, file_extension: str) -> str:
 
 
 # Save prettified xml to zip
-def save_prettified_xml_to_zip(xml_data: str, output_zip_path: str, xml_filename: str) -> None:
+def save_prettified_xml_to_zip(xml_data: str, output_zip_path: str, xml_filename: str, compression: int = ZIP_STORED) -> None:
     """
-        Save prettified XML data to a zip file.
+        Save XML data to a zip file, prettified if PRODCOM_PRETTY is set.
 
         Parameters
         -------------
@@ -77,6 +109,9 @@ def save_prettified_xml_to_zip(xml_data: str, output_zip_path: str, xml_filename
             The path to the output zip file.
         xml_filename: str 
             The name of the XML file inside the zip archive.
+        compression: int
+            Compression method of the zip archive. Metadata files are small and written
+            once, so they are stored uncompressed by default.
 
         Returns
         ------------
@@ -84,19 +119,33 @@ def save_prettified_xml_to_zip(xml_data: str, output_zip_path: str, xml_filename
     """
     try:
         # Prettify the XML data
-        prettified_xml = prettify_data(xml_data, ".xml")
+        if prettify_xml:
+            xml_data = prettify_data(xml_data, ".xml")
         
-        # Create a zip file and add the prettified XML
-        with ZipFile(output_zip_path, 'w', ZIP_DEFLATED) as zip_file:
-            zip_file.writestr(xml_filename, prettified_xml)
+        # Create a zip file and add the XML
+        with ZipFile(output_zip_path, 'w', compression) as zip_file:
+            zip_file.writestr(xml_filename, xml_data)
         
-        logger.info(f"Prettified XML saved to {output_zip_path} as {xml_filename}")
+        logger.info(f"XML saved to {output_zip_path} as {xml_filename}")
     except Exception as e:
-        logger.error(f"Failed to save prettified XML to zip: {e}")
+        logger.error(f"Failed to save XML to zip: {e}")
 
 
 # Get dataset information
-def get_datasets_info(metadata_type: str, save_dir: str):
+def get_datasets_info(metadata_type: str) -> dict:
+    '''
+        Download the catalogue of a metadata type and read its entries while parsing it.
+
+        Parameters
+        ----------
+        metadata_type : str
+            Type of metadata catalogue, e.g. "dataflow", "codelist" or "conceptscheme".
+
+        Returns
+        ----------
+        Dict mapping each id to its catalogue row, i.e. the attributes of the entry such as
+        its "structureURL" and its English "name". The first row of duplicated ids is kept.
+    '''
     params = {"lang": "en", "detail": "allstubs", "completestub": "true"}
     if metadata_type in ['dataflow', 'codelist']:
         params["lang"] = None
@@ -108,34 +157,113 @@ def get_datasets_info(metadata_type: str, save_dir: str):
     url = f"{base_url}{metadata_type}/ESTAT/all"
     
     try:
-        response = requests.get(url, params=params)
+        response = session.get(url, params=params, timeout=request_timeout)
         response.raise_for_status()  # This will raise an HTTPError for bad responses
-        data = response.content
     except requests.RequestException as e:
         logger.error(f"Failed to fetch data from {url}: {e}")
         logger.info(f"Got {metadata_type} in {time() - t1:.2f}s")
-        raise  # Ensure that we return here so that file saving and xml2csv_metadata are not called
+        raise
 
-    prettified_data = prettify_data(data, '.xml')
+    rows = {}
+    for _, item in etree.iterparse(io.BytesIO(response.content), events=('end',)):
+        if "structureURL" not in item.attrib:
+            continue
+        names = {name.get(lang_attribute): name.text for name in item.findall('c:Name', NS)}
+        rows.setdefault(item.get("id"), {**item.attrib, "name": names.get("en", next(iter(names.values()), None))})
+        item.clear()
+
+    logger.info(f"Got {metadata_type} in {time() - t1:.2f}s")
+    return rows
+
+
+# Load metadata catalogue
+def load_datasets_info(metadata_type: str) -> dict:
+    '''
+        Retrieve the rows of a metadata catalogue, downloading it only the first time
+        it is requested during a run.
+
+        Parameters
+        ----------
+        metadata_type : str
+            Type of metadata catalogue, e.g. "dataflow", "codelist" or "conceptscheme".
+
+        Returns
+        ----------
+        Dict mapping each id to its catalogue row, keeping the first row of duplicated ids.
+    '''
+    with catalog_lock:
+        if metadata_type not in datasets_info:
+            datasets_info[metadata_type] = get_datasets_info(metadata_type)
+        return datasets_info[metadata_type]
+
+
+# Load structure urls
+def load_structure_urls(metadata_type: str) -> dict:
+    '''
+        Retrieve the structure URL of every id in a metadata catalogue.
+
+        Parameters
+        ----------
+        metadata_type : str
+            Type of metadata catalogue, e.g. "dataflow", "codelist" or "conceptscheme".
+
+        Returns
+        ----------
+        Dict mapping each id to its structure URL.
+    '''
+    with catalog_lock:
+        if metadata_type not in structure_urls:
+            structure_urls[metadata_type] = {id: row["structureURL"] for id, row in load_datasets_info(metadata_type).items()}
+        return structure_urls[metadata_type]
 
-    # Save prettified data to file
-    try:
-        # Ensure the directory exists before saving the file
-        os.makedirs(save_dir, exist_ok=True)
-        with open(f'{save_dir}/{metadata_type}.xml', 'w', encoding='utf-8') as file:
-            file.write(prettified_data)
-        logger.info(f"Data has been prettified and saved to {save_dir}.")
-    except Exception as e:
-        logger.error(f"Failed to save data to file {save_dir}: {e}")
-        logger.info(f"Got {metadata_type} in {time() - t1:.2f}s")
-        return  # Ensure that we return here so that xml2csv_metadata is not called on failure
 
-    xml2csv_metadata(save_dir, save_dir, metadata_type)
+# Fetch structure
+def fetch_structure_xml(id: str, metadata_type: str, urls: dict = None) -> tempfile.SpooledTemporaryFile:
+    '''
+        Retrieve the structure XML of an id in a metadata catalogue. The response is
+        streamed into a spooled temporary file, so large structures are not held in memory.
 
+        Parameters
+        ----------
+        id : str
+            ID of the dataset or dimension in the catalogue.
+        metadata_type : str
+            Type of metadata catalogue, e.g. "codelist" or "conceptscheme".
+        urls : dict, optional
+            Structure URL of each id, as returned by load_structure_urls(metadata_type).
+            Loaded when not given.
+
+        Returns
+        ----------
+        Binary file with the structure XML positioned at its start, or None if the id
+        is not in the catalogue. The caller is responsible for closing it.
+    '''
+    if urls is None:
+        urls = load_structure_urls(metadata_type)
+    url = urls.get(id)
+
+    # If no matching row is found, log a message and exit
+    if url is None:
+        logger.warning(f"No {metadata_type} found for id {id} in the CSV.")
+        return None
+
+    structure = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    try:
+        with session.get(url, params={}, stream=True, timeout=request_timeout) as response:
+            # An error page must not be saved or parsed as the structure
+            response.raise_for_status()
+            # iter_content undoes the gzip transfer encoding, unlike response.raw
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                structure.write(chunk)
+    except Exception:
+        structure.close()
+        raise
+    structure.seek(0)
+    return structure
 
 
 # Download metadata
-def get_metadata(id: str, metadata_type: str, save_dir: str):
+def get_metadata(id: str, metadata_type: str, save_dir: str, urls: dict = None):
     '''
         Retrieve and save metadata for a given dataset.
 
@@ -150,6 +278,9 @@ def get_metadata(id: str, metadata_type: str, save_dir: str):
             Examples include "codelist" or "conceptscheme".
         save_dir : str
             Directory where the response content should be saved.
+        urls : dict, optional
+            Structure URL of each id, as returned by load_structure_urls(metadata_type).
+            Loaded when not given.
         
         Returns
         ----------
@@ -159,28 +290,15 @@ def get_metadata(id: str, metadata_type: str, save_dir: str):
 
     try:
         os.makedirs(save_dir, exist_ok=True)
-        # Read the CSV into a DataFrame
-        get_datasets_info(metadata_type, '.')
-        df = pd.read_csv(f'{metadata_type}.csv')
-        os.remove(f'{metadata_type}.csv')
-        os.remove(f'{metadata_type}.xml')
-
-        # Filter the row corresponding to the id
-        row = df[df["id"] == id]
-
-        # If no matching row is found, log a message and exit
-        if len(row) == 0:
-            logger.warning(f"No {metadata_type} found for id {id} in the CSV.")
+        structure = fetch_structure_xml(id, metadata_type, urls)
+        if structure is None:
             return
 
-        # Extract the structure URL from the row
-        url = row["structureURL"].values[0]
-
-        response = requests.get(url, params={})        
         zip_filename = f"dim_{id}.zip"
         zip_filepath = Path(save_dir) / zip_filename
         xml_filename = f"dim_{id}.xml"
-        save_prettified_xml_to_zip(response.content, zip_filepath, xml_filename)
+        with structure:
+            save_prettified_xml_to_zip(structure.read(), zip_filepath, xml_filename)
 
         logger.info(f"Successfully saved {metadata_type} for {id} to {save_dir}")
 
@@ -188,7 +306,53 @@ def get_metadata(id: str, metadata_type: str, save_dir: str):
         logger.error(f"An error occurred during the {metadata_type} request process: {e}")
 
 
+# Download codelists
+def get_codelists(code_list: list, save_dir: str, urls: dict = None):
+    '''
+        Retrieve and save the codelists of a dataset concurrently.
+
+        Parameters
+        ----------
+        code_list : list
+            The ids of the codelists used by the dataset.
+        save_dir : str
+            Directory where the codelists should be saved.
+        urls : dict, optional
+            Structure URL of each codelist id, as returned by load_structure_urls('codelist').
+
+        Returns
+        ----------
+        None
+    '''
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(lambda id: get_metadata(id, 'codelist', save_dir, urls), code_list))
+
+
+# Parse structure events
+def iter_end_events(structure):
+    '''
+        Parse a structure XML file incrementally, feeding a pull parser in chunks.
+
+        Parameters
+        ----------
+        structure : file
+            Binary file with the structure XML, as returned by fetch_structure_xml.
+
+        Returns
+        ----------
+        Iterator of ("end", element) events, in document order.
+    '''
+    # A pull parser cannot be reset once closed, so each document gets its own
+    parser = etree.XMLPullParser(events=('end',))
+    for chunk in iter(lambda: structure.read(chunk_size), b''):
+        parser.feed(chunk)
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
 # Get data version
+@lru_cache(maxsize=None)
 def get_data_version(dataset: str):
     '''
         Retrieve the data version for a given dataset.
@@ -200,18 +364,22 @@ def get_data_version(dataset: str):
 
         Returns 
         ----------
-        String with data version in format "YYYYMMDD".
+        String with data version in format "YYYYMMDD", or None if the structure has no prepared date.
     '''
-    get_metadata(dataset, 'conceptscheme', '.')
-    unzip_files('.')
-    root = ET.parse(f'dim_{dataset}.xml').getroot()
-    version = (root[0][2].text).split('T')[0].replace('-','')
-    os.remove(f'dim_{dataset}.xml')
-    os.remove(f'dim_{dataset}.zip')
-    return version
+    structure = fetch_structure_xml(dataset, 'conceptscheme')
+    if structure is None:
+        return None
+    # The version is the prepared date in the header, so stop parsing once the header is read
+    with structure:
+        for _, item in iter_end_events(structure):
+            if item.tag == header_tag:
+                prepared = item.findtext('m:Prepared', namespaces=NS)
+                return prepared.split('T')[0].replace('-','') if prepared else None
+    return None
 
 
 # Get columns in dataset
+@lru_cache(maxsize=None)
 def get_data_columns(dataset: str):
     '''
         Retrieve a list of the columns in a given dataset.
@@ -225,22 +393,20 @@ def get_data_columns(dataset: str):
         ----------
         List of data columns.
     '''
-    get_metadata(dataset, 'conceptscheme', '.')
-    unzip_files('.')
-    root = ET.parse(f'dim_{dataset}.xml').getroot()
-    NS = {"m": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message",
-          "s": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure",
-          "c": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/common",
-          "xml": "http://www.w3.org/XML/1998/namespace"}
+    structure = fetch_structure_xml(dataset, 'conceptscheme')
     ids = []
-    for item in root.findall(f".//s:Enumeration", NS):
-        ids.append(item[0].get('id'))
-    os.remove(f'dim_{dataset}.xml')
-    os.remove(f'dim_{dataset}.zip')
+    if structure is None:
+        return ids
+    with structure:
+        for _, item in iter_end_events(structure):
+            if item.tag == enumeration_tag:
+                ids.append(item[0].get('id'))
+                item.clear()
     return ids
 
 
 # Get dataset description
+@lru_cache(maxsize=None)
 def get_data_description(dataset: str):
     '''
         Retrieve a description of the dataset.
@@ -254,12 +420,8 @@ def get_data_description(dataset: str):
         ------------
         String with the dataset description.
     '''
-    get_datasets_info('dataflow', '.')
-    df = pd.read_csv('dataflow.csv')
-    filtered_df = df[df['id'] == dataset]
-    os.remove('dataflow.csv')
-    os.remove('dataflow.xml')
-    return filtered_df['name'].to_string(index=False)
+    row = load_datasets_info('dataflow').get(dataset)
+    return row['name'] if row else ''
 
 
 # Download/update data
@@ -288,68 +450,135 @@ def get_data(dataset: str, save_dir: str):
         want_zip = True)
 
 
+# Get the date the data was last modified
+def get_last_modified(dataset: str):
+    '''
+        Ask the Eurostat API when the data of a dataset last changed, without downloading it.
+
+        Parameters
+        ----------
+        dataset : str
+            The dataset to check.
+
+        Returns
+        ----------
+        String with the Last-Modified date in format "YYYYMMDD", or None if the server does not report it.
+    '''
+    url = f"{base_url}data/{dataset}/?format=SDMX-CSV&compressed=true&i"
+    try:
+        response = session.head(url, allow_redirects=True, timeout=request_timeout)
+        response.raise_for_status()
+        last_modified = response.headers.get('Last-Modified')
+        if not last_modified:
+            return None
+        return parsedate_to_datetime(last_modified).strftime('%Y%m%d')
+    except (requests.RequestException, TypeError, ValueError) as e:
+        logger.warning(f"Could not check when {dataset} was last modified: {e}")
+        return None
+
+
+# Collect a single dataset
+def process_dataset(config: Config, dataset: str) -> tuple:
+    '''
+        Download the data and metadata of a dataset if its version is newer than the
+        latest version in the resource repository. When the API reports that the data
+        has not been modified since that version, nothing else is requested.
+
+        Parameters
+        ----------
+        config : Config
+            Configuration holding the resource repository and schemas.
+        dataset : str
+            The dataset to collect.
+
+        Returns
+        ----------
+        Tuple of whether the dataset was downloaded and its DataResource.
+    '''
+    repo = config.resource_repository
+    resource = config.schemas.DataResource(
+        name=f'prodcom_{dataset}',
+        schema_name="None",
+        location="", 
+        task_name="prodcom_collect",
+        stage="collect",
+        data_flow_direction='output',
+        data_version="00000000",
+        code_version="0.0.0",
+        comment=f"Production data and metadata collected from prodcom for dataset {dataset}",
+        created_by="Albert K. Osei-Owusu",
+        license="Open Data Commons Public Domain Dedication (CC-BY 4.0)",
+        license_url="https://creativecommons.org/licenses/by-sa/4.0/legalcode",
+        description="",
+        url=""
+    )
+
+    resource.location = f"collect/prodcom/{dataset}/{resource.data_version}"
+
+    try:
+        latest_version = repo.get_latest_version(name=resource.name, stage=resource.stage, task_name=resource.task_name)
+    except:
+        latest_version = None
+
+    # Skip fetching the structure when the data has not changed since the latest version.
+    # A change on the day of the latest version may still be newer, so that date is checked.
+    if latest_version:
+        last_modified = get_last_modified(dataset)
+        if last_modified and last_modified < latest_version:
+            logger.info(f"{dataset} has not changed since {latest_version}")
+            return False, resource
+
+    online_version = get_data_version(dataset)
+    code_list = get_data_columns(dataset)
+    data_description = get_data_description(dataset)
+
+    if latest_version:
+        if latest_version == online_version:
+            return False, resource
+        resource.data_version = online_version
+    elif online_version:
+        resource.data_version = online_version
+    else:
+        resource.data_version = "00000000"
+
+    get_data(dataset, resource.location)
+    resource.description = data_description
+    for metadata in metadata_types:
+        urls = load_structure_urls(metadata)
+        if metadata == 'codelist':
+            get_codelists(code_list, f'{resource.location}/metadata', urls)
+        else:
+            get_metadata(dataset, metadata, f'{resource.location}/metadata', urls)
+    return True, resource
+
+
 def prodcom_collect(config: Config) -> bool:
     '''
         Add or update the data collected in Sharepoint as well as update the resources file.
+        The datasets are collected concurrently since the work is bound by the Eurostat API.
+        Cached catalogues and dataset lookups from a previous run are dropped first.
     '''
+    datasets_info.clear()
+    structure_urls.clear()
+    get_data_version.cache_clear()
+    get_data_columns.cache_clear()
+    get_data_description.cache_clear()
     repo = config.resource_repository
     did_update = False
 
-    for dataset in datasets:
-        resource = config.schemas.DataResource(
-            name=f'prodcom_{dataset}',
-            schema_name="None",
-            location="", 
-            task_name="prodcom_collect",
-            stage="collect",
-            data_flow_direction='output',
-            data_version="00000000",
-            code_version="0.0.0",
-            comment=f"Production data and metadata collected from prodcom for dataset {dataset}",
-            created_by="Albert K. Osei-Owusu",
-            license="Open Data Commons Public Domain Dedication (CC-BY 4.0)",
-            license_url="https://creativecommons.org/licenses/by-sa/4.0/legalcode",
-            description="",
-            url=""
-        )
-
-        resource.location = f"collect/prodcom/{dataset}/{resource.data_version}"
-
-        online_version = get_data_version(dataset)
-        code_list = get_data_columns(dataset)
-        data_description = get_data_description(dataset)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [(dataset, executor.submit(process_dataset, config, dataset)) for dataset in datasets]
 
+    # A failed dataset must not keep the datasets that did download from being registered
+    results = []
+    for dataset, future in futures:
         try:
-            latest_version = repo.get_latest_version(name=resource.name, stage=resource.stage, task_name=resource.task_name)
-        except:
-            latest_version = None
-        if latest_version:
-            if latest_version != online_version:
-                resource.data_version = online_version
-                get_data(dataset, resource.location)
-                resource.description = data_description
-                for metadata in metadata_types:
-                    if metadata == 'codelist':
-                        for id in code_list:
-                            get_metadata(id, metadata, f'{resource.location}/metadata')
-                    else:
-                        get_metadata(dataset, metadata, f'{resource.location}/metadata')
-                repo.add_or_update_resource_list(resource)
-                did_update = True
-        else:
-            if online_version:
-                resource.data_version = online_version
-            else:
-                resource.data_version = "00000000"
-            get_data(dataset, resource.location)
-            resource.description = data_description
-            for metadata in metadata_types:
-                    if metadata == 'codelist':
-                        for id in code_list:
-                            get_metadata(id, metadata, f'{resource.location}/metadata')
-                    else:
-                        get_metadata(dataset, metadata, f'{resource.location}/metadata')
+            results.append(future.result())
+        except Exception as e:
+            logger.error(f"Failed to collect dataset {dataset}: {e}")
+
+    for updated, resource in results:
+        if updated:
             repo.add_or_update_resource_list(resource)
             did_update = True
     return did_update
-
@@ -1,104 +1,141 @@
 import unittest
 from unittest.mock import patch, MagicMock, call
-from collect_tasks.eurostat_waste_collect import get_datasets_info, prettify_data, save_prettified_xml_to_zip, get_metadata, get_data_version, get_data_columns, get_data_description, get_data, eurostat_collect, Config
+from collect_tasks.eurostat_waste_collect import session, request_get, fetch_datasets_info, xml2df_metadata, load_catalog, catalogs, prettify_data, save_prettified_xml_to_zip, get_metadata, fetch_concept_xml, get_data_version, get_data_columns, get_data_structure, get_data_description, get_dataset_metadata, get_data, eurostat_collect, Config
 import json
 import pandas as pd
 import io
 from xml.dom.minidom import parseString
 import zipfile
 import os
+import tempfile
+import gzip
 from pathlib import Path
 import requests
 import xml.etree.ElementTree as ET
+from types import SimpleNamespace
 
 
 ###############################################################
-#                     Test get_datasets_info                  #
+#                       Test request_get                      #
 ###############################################################
 
-class TestGetDatasetsInfo(unittest.TestCase):
-    @patch('collect_tasks.eurostat_waste_collect.requests.get')
-    @patch('collect_tasks.eurostat_waste_collect.prettify_data')
-    @patch('builtins.open', new_callable=unittest.mock.mock_open)
-    @patch('collect_tasks.eurostat_waste_collect.xml2csv_metadata')
-    def test_successful_execution(self, mock_xml2csv_metadata, mock_open, mock_prettify_data, mock_requests_get):
-        # Mock the response from requests.get
+class TestRequestGet(unittest.TestCase):
+
+    @patch('collect_tasks.eurostat_waste_collect.session.get')  # Mock session.get
+    def test_request_get_uses_session(self, mock_session_get):
+        mock_session_get.return_value = MagicMock(status_code=200, headers={}, content=b'<xml>data</xml>')
+
+        content = request_get('http://example.com', params={'detail': 'allstubs'})
+
+        self.assertEqual(content, b'<xml>data</xml>')
+        mock_session_get.assert_called_once_with('http://example.com', params={'detail': 'allstubs'}, timeout=30, headers={})
+
+    @patch('collect_tasks.eurostat_waste_collect.session.get')  # Mock session.get
+    def test_request_get_revalidates_cached_response(self, mock_session_get):
+        first = requests.Response()
+        first.status_code = 200
+        first._content = b'<xml>data</xml>'
+        first.headers['ETag'] = '"abc"'
+        not_modified = requests.Response()
+        not_modified.status_code = 304
+        not_modified._content = b''
+        mock_session_get.side_effect = [first, not_modified]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with patch('collect_tasks.eurostat_waste_collect.cache_dir', tmp_dir):
+                request_get('http://example.com', params={})
+                content = request_get('http://example.com', params={})
+
+        # The second request is conditional and its body comes from the cache
+        self.assertEqual(mock_session_get.call_args_list[0], call('http://example.com', params={}, timeout=30, headers={}))
+        self.assertEqual(mock_session_get.call_args_list[1], call('http://example.com', params={}, timeout=30, headers={'If-None-Match': '"abc"'}))
+        self.assertEqual(content, b'<xml>data</xml>')
+
+    @patch('collect_tasks.eurostat_waste_collect.session.get')  # Mock session.get
+    def test_request_get_raises_on_error_response(self, mock_session_get):
+        response = requests.Response()
+        response.status_code = 503
+        response._content = b''
+        mock_session_get.return_value = response
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with patch('collect_tasks.eurostat_waste_collect.cache_dir', tmp_dir):
+                # An error body must not be returned as the resource
+                with self.assertRaises(requests.HTTPError):
+                    request_get('http://example.com', params={})
+
+    @patch('collect_tasks.eurostat_waste_collect.session.get')  # Mock session.get
+    def test_request_get_skips_cache_without_validators(self, mock_session_get):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'<xml>data</xml>'
+        mock_session_get.return_value = response
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with patch('collect_tasks.eurostat_waste_collect.cache_dir', tmp_dir):
+                request_get('http://example.com', params={})
+                self.assertEqual(os.listdir(tmp_dir), [])
+
+    @patch('collect_tasks.eurostat_waste_collect.session.get')  # Mock session.get
+    def test_request_get_ignores_unreadable_validators(self, mock_session_get):
+        first = requests.Response()
+        first.status_code = 200
+        first._content = b'<xml>data</xml>'
+        first.headers['ETag'] = '"abc"'
+        mock_session_get.return_value = first
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with patch('collect_tasks.eurostat_waste_collect.cache_dir', tmp_dir):
+                request_get('http://example.com', params={})
+                # Only the body and the validators are left, no temporary files
+                self.assertEqual(len(os.listdir(tmp_dir)), 2)
+
+                # Simulate validators that are empty while another thread rewrites them
+                for name in os.listdir(tmp_dir):
+                    if name.endswith('.json'):
+                        Path(tmp_dir, name).write_text('')
+                content = request_get('http://example.com', params={})
+
+        # The request falls back to a plain GET
+        self.assertEqual(mock_session_get.call_args_list[1], call('http://example.com', params={}, timeout=30, headers={}))
+        self.assertEqual(content, b'<xml>data</xml>')
+
+    def test_session_retries_throttled_requests(self):
+        retry = session.get_adapter('https://ec.europa.eu').max_retries
+
+        self.assertEqual(retry.total, 5)
+        self.assertIn(429, retry.status_forcelist)
+        self.assertGreater(retry.backoff_factor, 0)
+
+
+###############################################################
+#                   Test fetch_datasets_info                  #
+###############################################################
+
+class TestFetchDatasetsInfo(unittest.TestCase):
+    @patch('collect_tasks.eurostat_waste_collect.session.get')
+    def test_successful_execution(self, mock_session_get):
+        # Mock the response from session.get
         mock_response = MagicMock()
         mock_response.content = b'<xml>data</xml>'
-        mock_requests_get.return_value = mock_response
-        
-        # Mock prettified data
-        mock_prettify_data.return_value = '<xml>pretty data</xml>'
-        
-        # Define the directory to save files
-        save_dir = 'mock_save_dir'
-        
+        mock_session_get.return_value = mock_response
+
         # Call the function
-        get_datasets_info('dataflow', save_dir)
-        
-        # Check if requests.get was called correctly
-        mock_requests_get.assert_called_once_with('https://ec.europa.eu/eurostat/api/dissemination/sdmx/2.1/dataflow/ESTAT/all', params={'lang': None, 'detail': 'allstubs', 'completestub': 'true'})
-        
-        # Check if prettify_data was called correctly
-        mock_prettify_data.assert_called_once_with(b'<xml>data</xml>', '.xml')
-        
-        # Check if file was opened and written to correctly
-        mock_open.assert_called_once_with(f'{save_dir}/dataflow.xml', 'w', encoding='utf-8')
-        mock_open().write.assert_called_once_with('<xml>pretty data</xml>')
-        
-        # Check if xml2csv_metadata was called
-        mock_xml2csv_metadata.assert_called_once_with(save_dir, save_dir, 'dataflow')
-    
-    @patch('collect_tasks.eurostat_waste_collect.requests.get')
-    @patch('collect_tasks.eurostat_waste_collect.prettify_data')
-    @patch('builtins.open', new_callable=unittest.mock.mock_open)
-    @patch('collect_tasks.eurostat_waste_collect.xml2csv_metadata')
-    def test_http_request_failure(self, mock_xml2csv_metadata, mock_open, mock_prettify_data, mock_requests_get):
+        content = fetch_datasets_info('dataflow')
+
+        # Check if session.get was called correctly and the raw content is returned
+        mock_session_get.assert_called_once_with('https://ec.europa.eu/eurostat/api/dissemination/sdmx/2.1/dataflow/ESTAT/all', params={'lang': None, 'detail': 'allstubs', 'completestub': 'true'}, timeout=30, headers={})
+        self.assertEqual(content, b'<xml>data</xml>')
+
+    @patch('collect_tasks.eurostat_waste_collect.session.get')
+    def test_http_request_failure(self, mock_session_get):
         # Mock an HTTP request failure
-        mock_requests_get.side_effect = requests.RequestException("HTTP request failed")
-        
-        # Define the directory to save files
-        save_dir = 'mock_save_dir'
-        
+        mock_session_get.side_effect = requests.RequestException("HTTP request failed")
+
         # Call the function and assert it raises an exception
         with self.assertRaises(requests.RequestException):
-            get_datasets_info('dataflow', save_dir)
-        
-        # Ensure file write was not attempted
-        mock_open.assert_not_called()
-        
-        # Ensure xml2csv_metadata was not called
-        mock_xml2csv_metadata.assert_not_called()
-    
-    @patch('collect_tasks.eurostat_waste_collect.requests.get')
-    @patch('collect_tasks.eurostat_waste_collect.prettify_data')
-    @patch('builtins.open', new_callable=unittest.mock.mock_open)
-    @patch('collect_tasks.eurostat_waste_collect.xml2csv_metadata')
-    def test_file_save_failure(self, mock_xml2csv_metadata, mock_open, mock_prettify_data, mock_requests_get):
-        # Mock the response from requests.get
-        mock_response = MagicMock()
-        mock_response.content = b'<xml>data</xml>'
-        mock_requests_get.return_value = mock_response
-        
-        # Mock prettified data
-        mock_prettify_data.return_value = '<xml>pretty data</xml>'
-        
-        # Simulate file open failure
-        mock_open.side_effect = IOError("Failed to open file")
-        
-        # Define the directory to save files
-        save_dir = 'mock_save_dir'
-        
-        # Call the function
-        get_datasets_info('dataflow', save_dir)
-        
-        # Ensure xml2csv_metadata was not called
-        mock_xml2csv_metadata.assert_not_called()
-        
-        # Check if file was attempted to be opened
-        mock_open.assert_called_once_with(f'{save_dir}/dataflow.xml', 'w', encoding='utf-8')
-    
-    
+            fetch_datasets_info('dataflow')
+
 
 ###############################################################
 #                     Test prettify_data                      #
@@ -151,6 +188,28 @@ class TestPrettifyData(unittest.TestCase):
 
 class TestSavePrettifiedXmlToZip(unittest.TestCase):
 
+    @patch('collect_tasks.eurostat_waste_collect.ZipFile')  # Mock ZipFile
+    @patch('collect_tasks.eurostat_waste_collect.prettify_data')  # Mock prettify_data
+    @patch('collect_tasks.eurostat_waste_collect.logger')  # Mock logger
+    def test_save_raw_xml_to_zip_success(self, mock_logger, mock_prettify_data, mock_zipfile):
+        xml_data = b'<root><name>John</name><age>30</age><city>New York</city></root>'
+        output_zip_path = 'test.zip'
+        xml_filename = 'test.xml'
+
+        # Mock ZipFile context manager
+        mock_zip_file = MagicMock()
+        mock_zipfile.return_value.__enter__.return_value = mock_zip_file
+
+        # Call the function
+        save_prettified_xml_to_zip(xml_data, output_zip_path, xml_filename)
+
+        # The XML is stored as downloaded unless prettifying is requested
+        mock_prettify_data.assert_not_called()
+        mock_zipfile.assert_called_once_with(output_zip_path, 'w', zipfile.ZIP_DEFLATED)
+        mock_zip_file.writestr.assert_called_once_with(xml_filename, xml_data)
+        mock_logger.info.assert_called_once_with(f"XML saved to {output_zip_path} as {xml_filename}")
+
+    @patch('collect_tasks.eurostat_waste_collect.prettify_xml', True)
     @patch('collect_tasks.eurostat_waste_collect.ZipFile')  # Mock ZipFile
     @patch('collect_tasks.eurostat_waste_collect.prettify_data')  # Mock prettify_data
     @patch('collect_tasks.eurostat_waste_collect.logger')  # Mock logger
@@ -176,7 +235,7 @@ class TestSavePrettifiedXmlToZip(unittest.TestCase):
         mock_zip_file.writestr.assert_called_once_with(xml_filename, prettified_xml)
 
         # Check if logger.info was called
-        mock_logger.info.assert_called_once_with(f"Prettified XML saved to {output_zip_path} as {xml_filename}")
+        mock_logger.info.assert_called_once_with(f"XML saved to {output_zip_path} as {xml_filename}")
 
     @patch('collect_tasks.eurostat_waste_collect.ZipFile')  # Mock ZipFile
     @patch('collect_tasks.eurostat_waste_collect.prettify_data')  # Mock prettify_data
@@ -196,7 +255,75 @@ class TestSavePrettifiedXmlToZip(unittest.TestCase):
         save_prettified_xml_to_zip(xml_data, output_zip_path, xml_filename)
 
         # Check if logger.error was called
-        mock_logger.error.assert_called_once_with("Failed to save prettified XML to zip: Write failed")
+        mock_logger.error.assert_called_once_with("Failed to save XML to zip: Write failed")
+
+###############################################################
+#                    Test xml2df_metadata                     #
+###############################################################
+
+class TestXml2dfMetadata(unittest.TestCase):
+
+    def test_xml2df_metadata(self):
+        content = (
+            '<m:Structure xmlns:m="http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message" '
+            'xmlns:s="http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure" '
+            'xmlns:c="http://www.sdmx.org/resources/sdmxml/schemas/v2_1/common">'
+            '<m:Structures><s:Dataflows>'
+            '<s:Dataflow id="ENV_WASGEN" structureURL="http://example.com/ENV_WASGEN">'
+            '<c:Name xml:lang="de">Abfallaufkommen</c:Name><c:Name xml:lang="en">Generation of waste</c:Name>'
+            '</s:Dataflow>'
+            '<s:Dataflow id="ENV_WASMUN" structureURL="http://example.com/ENV_WASMUN">'
+            '<c:Name xml:lang="fr">Déchets municipaux</c:Name>'
+            '</s:Dataflow>'
+            '</s:Dataflows></m:Structures></m:Structure>'
+        ).encode('utf-8')
+
+        df = xml2df_metadata(content, 'dataflow')
+
+        # One row per entry, preferring the English name
+        self.assertEqual(df.to_dict('records'), [
+            {'id': 'ENV_WASGEN', 'structureURL': 'http://example.com/ENV_WASGEN', 'name': 'Generation of waste'},
+            {'id': 'ENV_WASMUN', 'structureURL': 'http://example.com/ENV_WASMUN', 'name': 'Déchets municipaux'}
+        ])
+
+    def test_xml2df_metadata_empty(self):
+        df = xml2df_metadata(b'<Structure/>', 'codelist')
+
+        self.assertTrue(df.empty)
+        self.assertEqual(list(df.columns), ['id', 'structureURL', 'name'])
+
+
+###############################################################
+#                      Test load_catalog                      #
+###############################################################
+
+class TestLoadCatalog(unittest.TestCase):
+
+    def setUp(self):
+        catalogs.clear()
+
+    @patch('collect_tasks.eurostat_waste_collect.fetch_datasets_info')  # Mock fetch_datasets_info
+    @patch('collect_tasks.eurostat_waste_collect.xml2df_metadata')  # Mock xml2df_metadata
+    def test_load_catalog_downloads_once(self, mock_xml2df_metadata, mock_fetch_datasets_info):
+        mock_xml2df_metadata.return_value = pd.DataFrame({
+            'id': ['123', '456', '123'],
+            'structureURL': ['http://example.com/123', 'http://example.com/456', 'http://example.com/123/old']
+        })
+
+        first = load_catalog('codelist')
+        second = load_catalog('codelist')
+
+        # The catalogue is fetched a single time and reused
+        self.assertIs(first, second)
+        mock_fetch_datasets_info.assert_called_once_with('codelist')
+        mock_xml2df_metadata.assert_called_once_with(mock_fetch_datasets_info.return_value, 'codelist')
+
+        # The catalogue is keyed by id, keeping the first entry of duplicated ids
+        self.assertEqual(first, {
+            '123': {'structureURL': 'http://example.com/123'},
+            '456': {'structureURL': 'http://example.com/456'}
+        })
+
 
 ###############################################################
 #                      Test get_metadata                      #
@@ -204,13 +331,16 @@ class TestSavePrettifiedXmlToZip(unittest.TestCase):
 
 class TestGetMetadata(unittest.TestCase):
 
-    @patch('collect_tasks.eurostat_waste_collect.get_datasets_info')  # Mock get_datasets_info
-    @patch('collect_tasks.eurostat_waste_collect.pd.read_csv')  # Mock pd.read_csv
-    @patch('collect_tasks.eurostat_waste_collect.os.remove')  # Mock os.remove
-    @patch('collect_tasks.eurostat_waste_collect.requests.get')  # Mock requests.get
+    def setUp(self):
+        catalogs.clear()
+
+    @patch('collect_tasks.eurostat_waste_collect.os.makedirs')  # Mock os.makedirs
+    @patch('collect_tasks.eurostat_waste_collect.fetch_datasets_info')  # Mock fetch_datasets_info
+    @patch('collect_tasks.eurostat_waste_collect.xml2df_metadata')  # Mock xml2df_metadata
+    @patch('collect_tasks.eurostat_waste_collect.session.get')  # Mock session.get
     @patch('collect_tasks.eurostat_waste_collect.save_prettified_xml_to_zip')  # Mock save_prettified_xml_to_zip
     @patch('collect_tasks.eurostat_waste_collect.logger')  # Mock logger
-    def test_get_metadata_success(self, mock_logger, mock_save_prettified_xml_to_zip, mock_requests_get, mock_os_remove, mock_read_csv, mock_get_datasets_info):
+    def test_get_metadata_success(self, mock_logger, mock_save_prettified_xml_to_zip, mock_session_get, mock_xml2df_metadata, mock_fetch_datasets_info, mock_makedirs):
         id = '123'
         metadata_type = 'codelist'
         save_dir = '/fake/dir'
@@ -221,8 +351,8 @@ class TestGetMetadata(unittest.TestCase):
             'structureURL': ['http://example.com/123', 'http://example.com/456']
         })
         
-        mock_read_csv.return_value = csv_data
-        mock_requests_get.return_value = MagicMock(content=b'fake_xml_content')
+        mock_xml2df_metadata.return_value = csv_data
+        mock_session_get.return_value = MagicMock(content=b'fake_xml_content')
         
         # Mock save_prettified_xml_to_zip to avoid actual file operations
         mock_save_prettified_xml_to_zip.return_value = None
@@ -231,13 +361,10 @@ class TestGetMetadata(unittest.TestCase):
         get_metadata(id, metadata_type, save_dir)
 
         # Assertions
-        mock_get_datasets_info.assert_called_once_with(metadata_type, '.')
-        mock_read_csv.assert_called_once_with(f'{metadata_type}.csv')
-        mock_os_remove.assert_has_calls([
-            call(f'{metadata_type}.csv'),
-            call(f'{metadata_type}.xml')
-        ], any_order=False)
-        mock_requests_get.assert_called_once_with('http://example.com/123', params={})
+        mock_makedirs.assert_called_once_with(save_dir, exist_ok=True)
+        mock_fetch_datasets_info.assert_called_once_with(metadata_type)
+        mock_xml2df_metadata.assert_called_once_with(mock_fetch_datasets_info.return_value, metadata_type)
+        mock_session_get.assert_called_once_with('http://example.com/123', params={}, timeout=30, headers={})
         mock_save_prettified_xml_to_zip.assert_called_once_with(
             b'fake_xml_content',
             Path(save_dir) / f"dim_{id}.zip",
@@ -245,13 +372,13 @@ class TestGetMetadata(unittest.TestCase):
         )
         mock_logger.info.assert_called_with(f"Successfully saved {metadata_type} for {id} to {save_dir}")
 
-    @patch('collect_tasks.eurostat_waste_collect.get_datasets_info')  # Mock get_datasets_info
-    @patch('collect_tasks.eurostat_waste_collect.pd.read_csv')  # Mock pd.read_csv
-    @patch('collect_tasks.eurostat_waste_collect.os.remove')  # Mock os.remove
-    @patch('collect_tasks.eurostat_waste_collect.requests.get')  # Mock requests.get
+    @patch('collect_tasks.eurostat_waste_collect.os.makedirs')  # Mock os.makedirs
+    @patch('collect_tasks.eurostat_waste_collect.fetch_datasets_info')  # Mock fetch_datasets_info
+    @patch('collect_tasks.eurostat_waste_collect.xml2df_metadata')  # Mock xml2df_metadata
+    @patch('collect_tasks.eurostat_waste_collect.session.get')  # Mock session.get
     @patch('collect_tasks.eurostat_waste_collect.save_prettified_xml_to_zip')  # Mock save_prettified_xml_to_zip
     @patch('collect_tasks.eurostat_waste_collect.logger')  # Mock logger
-    def test_get_metadata_no_matching_id(self, mock_logger, mock_save_prettified_xml_to_zip, mock_requests_get, mock_os_remove, mock_read_csv, mock_get_datasets_info):
+    def test_get_metadata_no_matching_id(self, mock_logger, mock_save_prettified_xml_to_zip, mock_session_get, mock_xml2df_metadata, mock_fetch_datasets_info, mock_makedirs):
         id = '999'
         metadata_type = 'codelist'
         save_dir = '/fake/dir'
@@ -259,156 +386,158 @@ class TestGetMetadata(unittest.TestCase):
             'id': ['123', '456'],
             'structureURL': ['http://example.com/123', 'http://example.com/456']
         })
-        mock_read_csv.return_value = csv_data
-        mock_os_remove.return_value = None
+        mock_xml2df_metadata.return_value = csv_data
 
         # Call the function
         get_metadata(id, metadata_type, save_dir)
 
         # Assertions
-        mock_get_datasets_info.assert_called_once_with(metadata_type, '.')
-        mock_read_csv.assert_called_once_with(f'{metadata_type}.csv')
-        mock_os_remove.assert_has_calls([
-            call(f'{metadata_type}.csv'),
-            call(f'{metadata_type}.xml')
-        ], any_order=False)
-        mock_requests_get.assert_not_called()
+        mock_fetch_datasets_info.assert_called_once_with(metadata_type)
+        mock_xml2df_metadata.assert_called_once_with(mock_fetch_datasets_info.return_value, metadata_type)
+        mock_session_get.assert_not_called()
         mock_save_prettified_xml_to_zip.assert_not_called()
         mock_logger.warning.assert_called_once_with(f"No {metadata_type} found for id {id} in the CSV.")
 
-    @patch('collect_tasks.eurostat_waste_collect.get_datasets_info')  # Mock get_datasets_info
-    @patch('collect_tasks.eurostat_waste_collect.pd.read_csv')  # Mock pd.read_csv
-    @patch('collect_tasks.eurostat_waste_collect.os.remove')  # Mock os.remove
-    @patch('collect_tasks.eurostat_waste_collect.requests.get')  # Mock requests.get
+    @patch('collect_tasks.eurostat_waste_collect.os.makedirs')  # Mock os.makedirs
+    @patch('collect_tasks.eurostat_waste_collect.fetch_datasets_info')  # Mock fetch_datasets_info
+    @patch('collect_tasks.eurostat_waste_collect.xml2df_metadata')  # Mock xml2df_metadata
+    @patch('collect_tasks.eurostat_waste_collect.session.get')  # Mock session.get
     @patch('collect_tasks.eurostat_waste_collect.save_prettified_xml_to_zip')  # Mock save_prettified_xml_to_zip
     @patch('collect_tasks.eurostat_waste_collect.logger')  # Mock logger
-    def test_get_metadata_exception(self, mock_logger, mock_save_prettified_xml_to_zip, mock_requests_get, mock_os_remove, mock_read_csv, mock_get_datasets_info):
+    def test_get_metadata_exception(self, mock_logger, mock_save_prettified_xml_to_zip, mock_session_get, mock_xml2df_metadata, mock_fetch_datasets_info, mock_makedirs):
         id = '123'
         metadata_type = 'codelist'
         save_dir = '/fake/dir'
-        mock_read_csv.side_effect = Exception("Read CSV failed")
+        mock_xml2df_metadata.side_effect = Exception("Parse failed")
 
         # Call the function and expect it to handle the exception
         get_metadata(id, metadata_type, save_dir)
 
         # Assertions
-        mock_get_datasets_info.assert_called_once_with(metadata_type, '.')
-        mock_read_csv.assert_called_once_with(f'{metadata_type}.csv')
-        mock_os_remove.assert_not_called()
-        mock_requests_get.assert_not_called()
+        mock_fetch_datasets_info.assert_called_once_with(metadata_type)
+        mock_xml2df_metadata.assert_called_once_with(mock_fetch_datasets_info.return_value, metadata_type)
+        mock_session_get.assert_not_called()
         mock_save_prettified_xml_to_zip.assert_not_called()
-        mock_logger.error.assert_called_once_with(f"An error occurred during the {metadata_type} request process: Read CSV failed")
+        mock_logger.error.assert_called_once_with(f"An error occurred during the {metadata_type} request process: Parse failed")
 
 
 ###############################################################
-#                   Test get_data_version                     #
+#                  Test fetch_concept_xml                     #
 ###############################################################
 
-class TestGetDataVersion(unittest.TestCase):
+class TestFetchConceptXml(unittest.TestCase):
 
-    @patch('collect_tasks.eurostat_waste_collect.get_metadata')  # Mock get_metadata
-    @patch('collect_tasks.eurostat_waste_collect.unzip_files')  # Mock unzip_files
-    @patch('collect_tasks.eurostat_waste_collect.ET.parse')  # Mock ET.parse
-    @patch('collect_tasks.eurostat_waste_collect.os.remove')  # Mock os.remove
-    def test_get_data_version_success(self, mock_os_remove, mock_et_parse, mock_unzip_files, mock_get_metadata):
+    @patch('collect_tasks.eurostat_waste_collect.load_catalog')  # Mock load_catalog
+    @patch('collect_tasks.eurostat_waste_collect.session.get')  # Mock session.get
+    def test_fetch_concept_xml_success(self, mock_session_get, mock_load_catalog):
         dataset = 'test_dataset'
+        mock_load_catalog.return_value = {dataset: {'structureURL': 'http://example.com/test_dataset'}}
+        mock_session_get.return_value = MagicMock(content=b'<root><child>text</child></root>')
 
-        # Create a mock XML structure
-        mock_tree = MagicMock()
-        mock_root = ET.Element('root')
+        # Call the function
+        content = fetch_concept_xml(dataset)
 
-        # Create the necessary elements to match root[0][2]
-        mock_element = ET.Element('element')
-        mock_sub_element1 = ET.SubElement(mock_element, 'sub_element1')
-        mock_sub_element2 = ET.SubElement(mock_element, 'sub_element2')
-        mock_sub_element3 = ET.SubElement(mock_element, 'sub_element3')  # This will be root[0][2]
+        # Assertions
+        self.assertEqual(content, b'<root><child>text</child></root>')
+        mock_load_catalog.assert_called_once_with('conceptscheme')
+        mock_session_get.assert_called_once_with('http://example.com/test_dataset', params={}, timeout=30, headers={})
 
-        mock_sub_element3.text = '2023-08-10T00:00:00Z'  # Ensure this element has the expected text
+    @patch('collect_tasks.eurostat_waste_collect.load_catalog')  # Mock load_catalog
+    @patch('collect_tasks.eurostat_waste_collect.session.get')  # Mock session.get
+    def test_fetch_concept_xml_unknown_dataset(self, mock_session_get, mock_load_catalog):
+        mock_load_catalog.return_value = {}
 
-        mock_root.append(mock_element)
-        mock_tree.getroot.return_value = mock_root
-        mock_et_parse.return_value = mock_tree
+        # Call the function and expect it to raise KeyError
+        with self.assertRaises(KeyError):
+            fetch_concept_xml('test_dataset')
 
-        # Setup mock objects
-        mock_get_metadata.return_value = None
-        mock_unzip_files.return_value = None
+        mock_session_get.assert_not_called()
+
+
+###############################################################
+#                   Test get_data_version                     #
+###############################################################
+
+def build_version_root():
+    # Create a structure message whose header holds the Prepared timestamp
+    message = '{http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message}'
+    mock_root = ET.Element(f'{message}Structure')
+    mock_header = ET.SubElement(mock_root, f'{message}Header')
+    ET.SubElement(mock_header, f'{message}ID').text = 'IREF000001'
+    ET.SubElement(mock_header, f'{message}Test').text = 'false'
+    ET.SubElement(mock_header, f'{message}Prepared').text = '2023-08-10T00:00:00Z'
+    return mock_root
+
+def build_columns_root():
+    # Create `Enumeration` elements with the namespace
+    mock_root = ET.Element('root')
+    for column_id in ['COLUMN_ID_1', 'COLUMN_ID_2']:
+        enumeration_element = ET.SubElement(mock_root, '{http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure}Enumeration')
+        item_element = ET.SubElement(enumeration_element, 'Item')
+        item_element.set('id', column_id)
+    return mock_root
+
+class TestGetDataVersion(unittest.TestCase):
+
+    @patch('collect_tasks.eurostat_waste_collect.fetch_concept_xml')  # Mock fetch_concept_xml
+    def test_get_data_version_success(self, mock_fetch_concept_xml):
+        dataset = 'test_dataset'
+        mock_fetch_concept_xml.return_value = ET.tostring(build_version_root())
 
         # Call the function
         version = get_data_version(dataset)
 
         # Assertions
         self.assertEqual(version, '20230810')
-        mock_get_metadata.assert_called_once_with(dataset, 'conceptscheme', '.')
-        mock_unzip_files.assert_called_once_with('.')
-        mock_et_parse.assert_called_once_with(f'dim_{dataset}.xml')
-        mock_os_remove.assert_has_calls([
-            unittest.mock.call(f'dim_{dataset}.xml'),
-            unittest.mock.call(f'dim_{dataset}.zip')
-        ])
+        mock_fetch_concept_xml.assert_called_once_with(dataset)
 
-    @patch('collect_tasks.eurostat_waste_collect.get_metadata')  # Mock get_metadata
-    @patch('collect_tasks.eurostat_waste_collect.unzip_files')  # Mock unzip_files
-    @patch('collect_tasks.eurostat_waste_collect.ET.parse')  # Mock ET.parse
-    @patch('collect_tasks.eurostat_waste_collect.os.remove')  # Mock os.remove
-    def test_get_data_version_file_not_found(self, mock_os_remove, mock_et_parse, mock_unzip_files, mock_get_metadata):
-        dataset = 'test_dataset'
+    @patch('collect_tasks.eurostat_waste_collect.fetch_concept_xml')  # Mock fetch_concept_xml
+    def test_get_data_version_stops_after_header(self, mock_fetch_concept_xml):
+        # The body after the header is malformed, so reading it would fail
+        mock_fetch_concept_xml.return_value = ET.tostring(build_version_root())[:-len(b'</ns0:Structure>')] + b'<ns0:Structures><broken>'
 
-        # Mock ET.parse to raise FileNotFoundError
-        mock_et_parse.side_effect = FileNotFoundError
-
-        # Call the function and expect it to raise FileNotFoundError
-        with self.assertRaises(FileNotFoundError):
-            get_data_version(dataset)
+        # Call the function
+        version = get_data_version('test_dataset')
 
         # Assertions
-        mock_get_metadata.assert_called_once_with(dataset, 'conceptscheme', '.')
-        mock_unzip_files.assert_called_once_with('.')
-        mock_et_parse.assert_called_once_with(f'dim_{dataset}.xml')
-        mock_os_remove.assert_not_called()
+        self.assertEqual(version, '20230810')
 
-    @patch('collect_tasks.eurostat_waste_collect.get_metadata')  # Mock get_metadata
-    @patch('collect_tasks.eurostat_waste_collect.unzip_files')  # Mock unzip_files
-    @patch('collect_tasks.eurostat_waste_collect.ET.parse')  # Mock ET.parse
-    @patch('collect_tasks.eurostat_waste_collect.os.remove')  # Mock os.remove
-    def test_get_data_version_xml_parse_error(self, mock_os_remove, mock_et_parse, mock_unzip_files, mock_get_metadata):
-        dataset = 'test_dataset'
+    @patch('collect_tasks.eurostat_waste_collect.fetch_concept_xml')  # Mock fetch_concept_xml
+    def test_get_data_version_missing_header(self, mock_fetch_concept_xml):
+        mock_fetch_concept_xml.return_value = b'<root><child>text</child></root>'
 
-        # Setup mock objects
-        mock_get_metadata.return_value = None
-        mock_unzip_files.return_value = None
+        # Without a Prepared timestamp no version can be read
+        self.assertIsNone(get_data_version('test_dataset'))
+
+    @patch('collect_tasks.eurostat_waste_collect.fetch_concept_xml')  # Mock fetch_concept_xml
+    def test_get_data_version_empty_prepared(self, mock_fetch_concept_xml):
+        root = build_version_root()
+        root[0][2].text = None
+        mock_fetch_concept_xml.return_value = ET.tostring(root)
 
-        # Mock ET.parse to raise ET.ParseError
-        mock_et_parse.side_effect = ET.ParseError
+        # An empty Prepared element holds no version either
+        self.assertIsNone(get_data_version('test_dataset'))
+
+    @patch('collect_tasks.eurostat_waste_collect.fetch_concept_xml')  # Mock fetch_concept_xml
+    def test_get_data_version_xml_parse_error(self, mock_fetch_concept_xml):
+        mock_fetch_concept_xml.return_value = b'<root><child>'
 
         # Call the function and expect it to raise ET.ParseError
         with self.assertRaises(ET.ParseError):
-            get_data_version(dataset)
-
-        # Assertions
-        mock_get_metadata.assert_called_once_with(dataset, 'conceptscheme', '.')
-        mock_unzip_files.assert_called_once_with('.')
-        mock_et_parse.assert_called_once_with(f'dim_{dataset}.xml')
-        mock_os_remove.assert_not_called()
+            get_data_version('test_dataset')
 
-    @patch('collect_tasks.eurostat_waste_collect.get_metadata')  # Mock get_metadata
-    @patch('collect_tasks.eurostat_waste_collect.unzip_files')  # Mock unzip_files
-    @patch('collect_tasks.eurostat_waste_collect.ET.parse')  # Mock ET.parse
-    @patch('collect_tasks.eurostat_waste_collect.os.remove')  # Mock os.remove
-    def test_get_data_version_exception(self, mock_os_remove, mock_et_parse, mock_unzip_files, mock_get_metadata):
+    @patch('collect_tasks.eurostat_waste_collect.fetch_concept_xml')  # Mock fetch_concept_xml
+    def test_get_data_version_exception(self, mock_fetch_concept_xml):
         dataset = 'test_dataset'
 
         # Setup mock objects
-        mock_get_metadata.side_effect = Exception("Metadata fetch failed")
+        mock_fetch_concept_xml.side_effect = Exception("Metadata fetch failed")
 
         # Call the function and expect it to raise the Exception
         with self.assertRaises(Exception):
             get_data_version(dataset)
 
-        # Assertions
-        mock_get_metadata.assert_called_once_with(dataset, 'conceptscheme', '.')
-        mock_unzip_files.assert_not_called()
-        mock_et_parse.assert_not_called()
-        mock_os_remove.assert_not_called()
+        mock_fetch_concept_xml.assert_called_once_with(dataset)
 
 
 ###############################################################
@@ -417,54 +546,48 @@ class TestGetDataVersion(unittest.TestCase):
 
 class TestGetDataColumns(unittest.TestCase):
 
-    @patch('collect_tasks.eurostat_waste_collect.get_metadata')  # Mock get_metadata
-    @patch('collect_tasks.eurostat_waste_collect.unzip_files')  # Mock unzip_files
-    @patch('collect_tasks.eurostat_waste_collect.ET.parse')  # Mock ET.parse
-    @patch('collect_tasks.eurostat_waste_collect.os.remove')  # Mock os.remove
-    def test_get_data_columns_success(self, mock_os_remove, mock_et_parse, mock_unzip_files, mock_get_metadata):
+    @patch('collect_tasks.eurostat_waste_collect.fetch_concept_xml')  # Mock fetch_concept_xml
+    def test_get_data_columns_success(self, mock_fetch_concept_xml):
         dataset = 'test_dataset'
-        # Namespace dictionary to match the function's use
-        NS = {"m": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message",
-              "s": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure",
-              "c": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/common",
-              "xml": "http://www.w3.org/XML/1998/namespace"}
-
-        # Create a mock XML structure with the correct namespaces
-        mock_tree = MagicMock()
-        mock_root = ET.Element('root')
-
-        # Create `Enumeration` elements with the namespace
-        enumeration_element = ET.Element('{http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure}Enumeration')
-        item_element = ET.SubElement(enumeration_element, 'Item')
-        item_element.set('id', 'COLUMN_ID_1')  # First ID
+        mock_fetch_concept_xml.return_value = ET.tostring(build_columns_root())
 
-        enumeration_element2 = ET.Element('{http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure}Enumeration')
-        item_element2 = ET.SubElement(enumeration_element2, 'Item')
-        item_element2.set('id', 'COLUMN_ID_2')  # Second ID
+        # Call the function
+        columns = get_data_columns(dataset)
 
-        # Append to root
-        mock_root.append(enumeration_element)
-        mock_root.append(enumeration_element2)
+        # Assertions
+        self.assertEqual(columns, ['COLUMN_ID_1', 'COLUMN_ID_2'])  # Expect the IDs to be in the list
+        mock_fetch_concept_xml.assert_called_once_with(dataset)
 
-        mock_tree.getroot.return_value = mock_root
-        mock_et_parse.return_value = mock_tree
+    @patch('collect_tasks.eurostat_waste_collect.fetch_concept_xml')  # Mock fetch_concept_xml
+    def test_get_data_columns_xml_parse_error(self, mock_fetch_concept_xml):
+        mock_fetch_concept_xml.return_value = b'<root><child>'
 
-        # Setup mock objects
-        mock_get_metadata.return_value = None
-        mock_unzip_files.return_value = None
+        # Call the function and expect it to raise ET.ParseError
+        with self.assertRaises(ET.ParseError):
+            get_data_columns('test_dataset')
+
+
+###############################################################
+#                  Test get_data_structure                    #
+###############################################################
+
+class TestGetDataStructure(unittest.TestCase):
+
+    @patch('collect_tasks.eurostat_waste_collect.fetch_concept_xml')  # Mock fetch_concept_xml
+    def test_get_data_structure_single_fetch(self, mock_fetch_concept_xml):
+        dataset = 'test_dataset'
+        mock_root = build_version_root()
+        for enumeration_element in build_columns_root():
+            mock_root.append(enumeration_element)
+        mock_fetch_concept_xml.return_value = ET.tostring(mock_root)
 
         # Call the function
-        columns = get_data_columns(dataset)
+        version, columns = get_data_structure(dataset)
 
         # Assertions
-        self.assertEqual(columns, ['COLUMN_ID_1', 'COLUMN_ID_2'])  # Expect the IDs to be in the list
-        mock_get_metadata.assert_called_once_with(dataset, 'conceptscheme', '.')
-        mock_unzip_files.assert_called_once_with('.')
-        mock_et_parse.assert_called_once_with(f'dim_{dataset}.xml')
-        mock_os_remove.assert_has_calls([
-            unittest.mock.call(f'dim_{dataset}.xml'),
-            unittest.mock.call(f'dim_{dataset}.zip')
-        ])
+        self.assertEqual(version, '20230810')
+        self.assertEqual(columns, ['COLUMN_ID_1', 'COLUMN_ID_2'])
+        mock_fetch_concept_xml.assert_called_once_with(dataset)
 
 
 ###############################################################
@@ -473,30 +596,52 @@ class TestGetDataColumns(unittest.TestCase):
 
 class TestGetDataDescription(unittest.TestCase):
 
-    @patch('collect_tasks.eurostat_waste_collect.os.remove')  # Mock os.remove
-    @patch('collect_tasks.eurostat_waste_collect.pd.read_csv')  # Mock pd.read_csv
-    @patch('collect_tasks.eurostat_waste_collect.get_datasets_info')  # Mock get_datasets_info
-    def test_get_data_description_success(self, mock_get_datasets_info, mock_read_csv, mock_os_remove):
+    def setUp(self):
+        catalogs.clear()
+
+    @patch('collect_tasks.eurostat_waste_collect.xml2df_metadata')  # Mock xml2df_metadata
+    @patch('collect_tasks.eurostat_waste_collect.fetch_datasets_info')  # Mock fetch_datasets_info
+    def test_get_data_description_success(self, mock_fetch_datasets_info, mock_xml2df_metadata):
         dataset = 'test_dataset'
 
-        # Mock the DataFrame returned by pd.read_csv
+        # Mock the DataFrame returned by xml2df_metadata
         mock_df = pd.DataFrame({
             'id': ['test_dataset', 'other_dataset'],
             'name': ['Test Dataset Description', 'Other Dataset Description']
         })
-        mock_read_csv.return_value = mock_df
+        mock_xml2df_metadata.return_value = mock_df
 
         # Call the function
         description = get_data_description(dataset)
 
         # Assertions
         self.assertEqual(description.strip(), 'Test Dataset Description')  # The returned description should match
-        mock_get_datasets_info.assert_called_once_with('dataflow', '.')  # Ensure get_datasets_info was called with the correct arguments
-        mock_read_csv.assert_called_once_with('dataflow.csv')  # Ensure read_csv was called with the correct file name
-        mock_os_remove.assert_has_calls([
-            call('dataflow.csv'),
-            call('dataflow.xml')
-        ], any_order=False)
+        mock_fetch_datasets_info.assert_called_once_with('dataflow')
+        mock_xml2df_metadata.assert_called_once_with(mock_fetch_datasets_info.return_value, 'dataflow')
+
+
+###############################################################
+#                 Test get_dataset_metadata                   #
+###############################################################
+
+class TestGetDatasetMetadata(unittest.TestCase):
+
+    @patch('collect_tasks.eurostat_waste_collect.get_metadata')  # Mock get_metadata
+    def test_get_dataset_metadata_all_types(self, mock_get_metadata):
+        dataset = 'test_dataset'
+        save_dir = '/path/to/save/metadata'
+
+        # Call the function
+        get_dataset_metadata(dataset, ['column1', 'column2'], save_dir)
+
+        # One request per codelist id, the other types are requested for the dataset
+        mock_get_metadata.assert_has_calls([
+            call(dataset, 'dataflow', save_dir),
+            call('column1', metadata_type='codelist', save_dir=save_dir),
+            call('column2', metadata_type='codelist', save_dir=save_dir),
+            call(dataset, 'conceptscheme', save_dir)
+        ], any_order=True)
+        self.assertEqual(mock_get_metadata.call_count, 4)
 
 
 ###############################################################
@@ -505,24 +650,51 @@ class TestGetDataDescription(unittest.TestCase):
 
 class TestGetData(unittest.TestCase):
 
-    @patch('collect_tasks.eurostat_waste_collect.save_request')  # Mock the save_request function
-    def test_get_data_success(self, mock_save_request):
+    def mock_download(self, mock_session_get, content):
+        # Mock a streamed response used as a context manager
+        mock_response = MagicMock()
+        mock_response.iter_content.return_value = [content[:10], content[10:]]
+        mock_session_get.return_value.__enter__.return_value = mock_response
+        return mock_response
+
+    @patch('collect_tasks.eurostat_waste_collect.session.get')  # Mock session.get
+    def test_get_data_success(self, mock_session_get):
         dataset = 'test_dataset'
-        save_dir = '/path/to/save'
+        csv_data = b'DATAFLOW,geo,OBS_VALUE\nESTAT:TEST,DK,1\n'
+        mock_response = self.mock_download(mock_session_get, gzip.compress(csv_data))
 
-        # Call the function
-        get_data(dataset, save_dir)
+        with tempfile.TemporaryDirectory() as save_dir:
+            # Call the function
+            get_data(dataset, save_dir)
+
+            # The gzip download is stored as a zipped CSV and the download removed
+            self.assertEqual(os.listdir(save_dir), [f'{dataset}.zip'])
+            with zipfile.ZipFile(os.path.join(save_dir, f'{dataset}.zip')) as zip_file:
+                self.assertEqual(zip_file.read(f'{dataset}.csv'), csv_data)
 
         # Assertions
-        mock_save_request.assert_called_once_with(
-            url=f"https://ec.europa.eu/eurostat/api/dissemination/sdmx/2.1/data/{dataset}/?format=SDMX-CSV&compressed=true&i",
-            params={},
-            path=save_dir,
-            file_stem=dataset,
-            create_path=True,
-            overwrite=True,
-            want_zip=True
+        mock_session_get.assert_called_once_with(
+            f"https://ec.europa.eu/eurostat/api/dissemination/sdmx/2.1/data/{dataset}/?format=SDMX-CSV&compressed=true&i",
+            stream=True,
+            timeout=30,
+            headers={"Accept-Encoding": "identity"}
         )
+        mock_response.raise_for_status.assert_called_once()
+        mock_response.iter_content.assert_called_once_with(chunk_size=1 << 20)
+
+    @patch('collect_tasks.eurostat_waste_collect.session.get')  # Mock session.get
+    def test_get_data_uncompressed(self, mock_session_get):
+        dataset = 'test_dataset'
+        csv_data = b'DATAFLOW,geo,OBS_VALUE\nESTAT:TEST,DK,1\n'
+        self.mock_download(mock_session_get, csv_data)
+
+        with tempfile.TemporaryDirectory() as save_dir:
+            # Call the function
+            get_data(dataset, save_dir)
+
+            # A payload that is not gzip compressed is zipped as it is
+            with zipfile.ZipFile(os.path.join(save_dir, f'{dataset}.zip')) as zip_file:
+                self.assertEqual(zip_file.read(f'{dataset}.csv'), csv_data)
 
 
 ###############################################################
@@ -531,12 +703,11 @@ class TestGetData(unittest.TestCase):
 
 class TestEurostatCollect(unittest.TestCase):
 
-    @patch('collect_tasks.eurostat_waste_collect.get_data_version')  # Mock get_data_version
-    @patch('collect_tasks.eurostat_waste_collect.get_data_columns')  # Mock get_data_columns
+    @patch('collect_tasks.eurostat_waste_collect.get_data_structure')  # Mock get_data_structure
     @patch('collect_tasks.eurostat_waste_collect.get_data_description')  # Mock get_data_description
     @patch('collect_tasks.eurostat_waste_collect.get_data')  # Mock get_data
     @patch('collect_tasks.eurostat_waste_collect.get_metadata')  # Mock get_metadata
-    def test_eurostat_collect_no_previous_version(self, mock_get_metadata, mock_get_data, mock_get_data_description, mock_get_data_columns, mock_get_data_version):
+    def test_eurostat_collect_no_previous_version(self, mock_get_metadata, mock_get_data, mock_get_data_description, mock_get_data_structure):
         # Setup mock objects
         mock_repo = MagicMock()
         mock_repo.get_latest_version.side_effect = Exception("No previous version")  # Simulate no previous version
@@ -544,8 +715,7 @@ class TestEurostatCollect(unittest.TestCase):
         mock_config.resource_repository = mock_repo
         mock_config.schemas.DataResource = MagicMock()
 
-        mock_get_data_version.return_value = '20230810'
-        mock_get_data_columns.return_value = ['column1', 'column2']
+        mock_get_data_structure.return_value = ('20230810', ['column1', 'column2'])
         mock_get_data_description.return_value = 'Test Dataset Description'
 
         # Call the function
@@ -564,12 +734,11 @@ class TestEurostatCollect(unittest.TestCase):
         # Ensure add_or_update_resource_list is called once for each dataset
         self.assertEqual(mock_repo.add_or_update_resource_list.call_count, len(datasets))
 
-    @patch('collect_tasks.eurostat_waste_collect.get_data_version')  # Mock get_data_version
-    @patch('collect_tasks.eurostat_waste_collect.get_data_columns')  # Mock get_data_columns
+    @patch('collect_tasks.eurostat_waste_collect.get_data_structure')  # Mock get_data_structure
     @patch('collect_tasks.eurostat_waste_collect.get_data_description')  # Mock get_data_description
     @patch('collect_tasks.eurostat_waste_collect.get_data')  # Mock get_data
     @patch('collect_tasks.eurostat_waste_collect.get_metadata')  # Mock get_metadata
-    def test_eurostat_collect_existing_version_no_update(self, mock_get_metadata, mock_get_data, mock_get_data_description, mock_get_data_columns, mock_get_data_version):
+    def test_eurostat_collect_existing_version_no_update(self, mock_get_metadata, mock_get_data, mock_get_data_description, mock_get_data_structure):
         # Setup mock objects
         mock_repo = MagicMock()
         mock_repo.get_latest_version.return_value = '20230810'  # Latest version matches online version
@@ -577,8 +746,7 @@ class TestEurostatCollect(unittest.TestCase):
         mock_config.resource_repository = mock_repo
         mock_config.schemas.DataResource = MagicMock()
 
-        mock_get_data_version.return_value = '20230810'  # Same as the latest version
-        mock_get_data_columns.return_value = ['column1', 'column2']
+        mock_get_data_structure.return_value = ('20230810', ['column1', 'column2'])  # Same as the latest version
         mock_get_data_description.return_value = 'Test Dataset Description'
 
         # Call the function
@@ -590,12 +758,11 @@ class TestEurostatCollect(unittest.TestCase):
         mock_get_data.assert_not_called()
         mock_get_metadata.assert_not_called()
 
-    @patch('collect_tasks.eurostat_waste_collect.get_data_version')  # Mock get_data_version
-    @patch('collect_tasks.eurostat_waste_collect.get_data_columns')  # Mock get_data_columns
+    @patch('collect_tasks.eurostat_waste_collect.get_data_structure')  # Mock get_data_structure
     @patch('collect_tasks.eurostat_waste_collect.get_data_description')  # Mock get_data_description
     @patch('collect_tasks.eurostat_waste_collect.get_data')  # Mock get_data
     @patch('collect_tasks.eurostat_waste_collect.get_metadata')  # Mock get_metadata
-    def test_eurostat_collect_existing_version_update(self, mock_get_metadata, mock_get_data, mock_get_data_description, mock_get_data_columns, mock_get_data_version):
+    def test_eurostat_collect_existing_version_update(self, mock_get_metadata, mock_get_data, mock_get_data_description, mock_get_data_structure):
         # Setup mock objects
         mock_repo = MagicMock()
         mock_repo.get_latest_version.return_value = '20230809'  # Simulate an older version exists
@@ -603,8 +770,7 @@ class TestEurostatCollect(unittest.TestCase):
         mock_config.resource_repository = mock_repo
         mock_config.schemas.DataResource = MagicMock()
 
-        mock_get_data_version.return_value = '20230810'  # Newer version is available online
-        mock_get_data_columns.return_value = ['column1', 'column2']
+        mock_get_data_structure.return_value = ('20230810', ['column1', 'column2'])  # Newer version is available online
         mock_get_data_description.return_value = 'Test Dataset Description'
 
         # Call the function
@@ -624,5 +790,87 @@ class TestEurostatCollect(unittest.TestCase):
         self.assertEqual(mock_repo.add_or_update_resource_list.call_count, len(datasets))
 
 
+    @patch('collect_tasks.eurostat_waste_collect.get_data_structure')  # Mock get_data_structure
+    @patch('collect_tasks.eurostat_waste_collect.get_data_description')  # Mock get_data_description
+    @patch('collect_tasks.eurostat_waste_collect.get_data')  # Mock get_data
+    @patch('collect_tasks.eurostat_waste_collect.get_metadata')  # Mock get_metadata
+    def test_eurostat_collect_only_outdated_datasets(self, mock_get_metadata, mock_get_data, mock_get_data_description, mock_get_data_structure):
+        # Setup mock objects, only ENV_WASMUN has a newer version online
+        mock_repo = MagicMock()
+        mock_repo.get_latest_version.side_effect = lambda name, stage, task_name: '20230809' if name == 'eurostat_waste_ENV_WASMUN' else '20230810'
+        mock_config = MagicMock()
+        mock_config.resource_repository = mock_repo
+        mock_config.schemas.DataResource.side_effect = lambda **kwargs: SimpleNamespace(**kwargs)
+
+        mock_get_data_structure.return_value = ('20230810', ['column1', 'column2'])
+        mock_get_data_description.return_value = 'Test Dataset Description'
+
+        # Call the function
+        did_update = eurostat_collect(mock_config)
+
+        # All versions are checked, but only the outdated dataset is downloaded
+        self.assertTrue(did_update)
+        self.assertEqual(mock_get_data_structure.call_count, 23)
+        mock_get_data.assert_called_once_with('ENV_WASMUN', 'collect/eurostat/ENV_WASMUN/00000000')
+        mock_get_data_description.assert_called_once_with('ENV_WASMUN')
+        self.assertEqual(mock_repo.add_or_update_resource_list.call_count, 1)
+
+    @patch('collect_tasks.eurostat_waste_collect.get_data_structure')  # Mock get_data_structure
+    @patch('collect_tasks.eurostat_waste_collect.get_data_description')  # Mock get_data_description
+    @patch('collect_tasks.eurostat_waste_collect.get_data')  # Mock get_data
+    @patch('collect_tasks.eurostat_waste_collect.get_metadata')  # Mock get_metadata
+    def test_eurostat_collect_failed_dataset(self, mock_get_metadata, mock_get_data, mock_get_data_description, mock_get_data_structure):
+        # Setup mock objects, the download of ENV_WW_SPD fails
+        mock_repo = MagicMock()
+        mock_repo.get_latest_version.side_effect = Exception("No previous version")
+        mock_config = MagicMock()
+        mock_config.resource_repository = mock_repo
+        mock_config.schemas.DataResource.side_effect = lambda **kwargs: SimpleNamespace(**kwargs)
+
+        mock_get_data_structure.return_value = ('20230810', ['column1', 'column2'])
+        mock_get_data_description.return_value = 'Test Dataset Description'
+        def get_data(dataset, location):
+            if dataset == 'ENV_WW_SPD':
+                raise Exception("500")
+        mock_get_data.side_effect = get_data
+
+        # Call the function
+        did_update = eurostat_collect(mock_config)
+
+        # Every other dataset is still registered
+        self.assertTrue(did_update)
+        registered = [call.args[0].name for call in mock_repo.add_or_update_resource_list.call_args_list]
+        self.assertEqual(len(registered), 22)
+        self.assertNotIn('eurostat_waste_ENV_WW_SPD', registered)
+
+    @patch('collect_tasks.eurostat_waste_collect.get_data_structure')  # Mock get_data_structure
+    @patch('collect_tasks.eurostat_waste_collect.get_data_description')  # Mock get_data_description
+    @patch('collect_tasks.eurostat_waste_collect.get_data')  # Mock get_data
+    @patch('collect_tasks.eurostat_waste_collect.get_metadata')  # Mock get_metadata
+    def test_eurostat_collect_failed_structure(self, mock_get_metadata, mock_get_data, mock_get_data_description, mock_get_data_structure):
+        # Setup mock objects, the structure of ENV_WASMUN cannot be read
+        mock_repo = MagicMock()
+        mock_repo.get_latest_version.side_effect = Exception("No previous version")
+        mock_config = MagicMock()
+        mock_config.resource_repository = mock_repo
+        mock_config.schemas.DataResource.side_effect = lambda **kwargs: SimpleNamespace(**kwargs)
+
+        def get_data_structure(dataset):
+            if dataset == 'ENV_WASMUN':
+                raise KeyError(dataset)
+            return ('20230810', ['column1', 'column2'])
+        mock_get_data_structure.side_effect = get_data_structure
+        mock_get_data_description.return_value = 'Test Dataset Description'
+
+        # Call the function
+        did_update = eurostat_collect(mock_config)
+
+        # The dataset is skipped, every other dataset is still downloaded and registered
+        self.assertTrue(did_update)
+        self.assertEqual(mock_get_data.call_count, 22)
+        registered = [call.args[0].name for call in mock_repo.add_or_update_resource_list.call_args_list]
+        self.assertEqual(len(registered), 22)
+        self.assertNotIn('eurostat_waste_ENV_WASMUN', registered)
+
 if __name__ == '__main__':
     unittest.main()
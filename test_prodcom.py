@@ -1,6 +1,7 @@
 import unittest
+from types import SimpleNamespace
 from unittest.mock import patch, MagicMock, call
-from collect_tasks.prodcom_collect import get_datasets_info, prettify_data, save_prettified_xml_to_zip, get_metadata, get_data_version, get_data_columns, get_data_description, get_data, prodcom_collect, Config
+from collect_tasks.prodcom_collect import session, get_datasets_info, load_datasets_info, datasets_info, load_structure_urls, structure_urls, prettify_data, save_prettified_xml_to_zip, get_metadata, get_codelists, fetch_structure_xml, iter_end_events, get_data_version, get_data_columns, get_data_description, get_data, get_last_modified, prodcom_collect, etree, Config
 import json
 import pandas as pd
 import io
@@ -12,91 +13,65 @@ import requests
 import xml.etree.ElementTree as ET
 
 
+###############################################################
+#                        Test session                         #
+###############################################################
+
+class TestSession(unittest.TestCase):
+
+    def test_session_reuses_connections(self):
+        adapter = session.get_adapter('https://ec.europa.eu')
+
+        # Connections to ec.europa.eu are pooled and responses requested gzip compressed
+        self.assertEqual(adapter._pool_maxsize, 16)
+        self.assertEqual(session.headers['Accept-Encoding'], 'gzip')
+
+
 ###############################################################
 #                     Test get_datasets_info                  #
 ###############################################################
 
 class TestGetDatasetsInfo(unittest.TestCase):
-    @patch('collect_tasks.prodcom_collect.requests.get')
-    @patch('collect_tasks.prodcom_collect.prettify_data')
-    @patch('builtins.open', new_callable=unittest.mock.mock_open)
-    @patch('collect_tasks.prodcom_collect.xml2csv_metadata')
-    def test_successful_execution(self, mock_xml2csv_metadata, mock_open, mock_prettify_data, mock_requests_get):
-        # Mock the response from requests.get
+    @patch('collect_tasks.prodcom_collect.session.get')
+    def test_successful_execution(self, mock_session_get):
+        # Mock the response from session.get
         mock_response = MagicMock()
-        mock_response.content = b'<xml>data</xml>'
-        mock_requests_get.return_value = mock_response
-        
-        # Mock prettified data
-        mock_prettify_data.return_value = '<xml>pretty data</xml>'
-        
-        # Define the directory to save files
-        save_dir = 'mock_save_dir'
+        mock_response.content = (
+            '<m:Structure xmlns:m="http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message" '
+            'xmlns:s="http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure" '
+            'xmlns:c="http://www.sdmx.org/resources/sdmxml/schemas/v2_1/common">'
+            '<m:Structures><s:Dataflows>'
+            '<s:Dataflow id="DS-056121" structureURL="http://example.com/DS-056121">'
+            '<c:Name xml:lang="de">Produktion</c:Name><c:Name xml:lang="en">Production</c:Name>'
+            '</s:Dataflow>'
+            '<s:Dataflow id="DS-056120" structureURL="http://example.com/DS-056120">'
+            '<c:Name xml:lang="fr">Production annuelle</c:Name>'
+            '</s:Dataflow>'
+            '<s:Dataflow id="DS-056121" structureURL="http://example.com/DS-056121/old"/>'
+            '</s:Dataflows></m:Structures></m:Structure>'
+        ).encode('utf-8')
+        mock_session_get.return_value = mock_response
         
         # Call the function
-        get_datasets_info('dataflow', save_dir)
-        
-        # Check if requests.get was called correctly
-        mock_requests_get.assert_called_once_with('https://ec.europa.eu/eurostat/api/comext/dissemination/sdmx/2.1/dataflow/ESTAT/all', params={'lang': None, 'detail': 'allstubs', 'completestub': 'true'})
-        
-        # Check if prettify_data was called correctly
-        mock_prettify_data.assert_called_once_with(b'<xml>data</xml>', '.xml')
+        rows = get_datasets_info('dataflow')
         
-        # Check if file was opened and written to correctly
-        mock_open.assert_called_once_with(f'{save_dir}/dataflow.xml', 'w', encoding='utf-8')
-        mock_open().write.assert_called_once_with('<xml>pretty data</xml>')
+        # Check if session.get was called correctly
+        mock_session_get.assert_called_once_with('https://ec.europa.eu/eurostat/api/comext/dissemination/sdmx/2.1/dataflow/ESTAT/all', params={'lang': None, 'detail': 'allstubs', 'completestub': 'true'}, timeout=30)
         
-        # Check if xml2csv_metadata was called
-        mock_xml2csv_metadata.assert_called_once_with(save_dir, save_dir, 'dataflow')
+        # One row per id with the English name where there is one, keeping the first row of duplicated ids
+        self.assertEqual(rows, {
+            'DS-056121': {'id': 'DS-056121', 'structureURL': 'http://example.com/DS-056121', 'name': 'Production'},
+            'DS-056120': {'id': 'DS-056120', 'structureURL': 'http://example.com/DS-056120', 'name': 'Production annuelle'}
+        })
     
-    @patch('collect_tasks.prodcom_collect.requests.get')
-    @patch('collect_tasks.prodcom_collect.prettify_data')
-    @patch('builtins.open', new_callable=unittest.mock.mock_open)
-    @patch('collect_tasks.prodcom_collect.xml2csv_metadata')
-    def test_http_request_failure(self, mock_xml2csv_metadata, mock_open, mock_prettify_data, mock_requests_get):
+    @patch('collect_tasks.prodcom_collect.session.get')
+    def test_http_request_failure(self, mock_session_get):
         # Mock an HTTP request failure
-        mock_requests_get.side_effect = requests.RequestException("HTTP request failed")
-        
-        # Define the directory to save files
-        save_dir = 'mock_save_dir'
+        mock_session_get.side_effect = requests.RequestException("HTTP request failed")
         
         # Call the function and assert it raises an exception
         with self.assertRaises(requests.RequestException):
-            get_datasets_info('dataflow', save_dir)
-        
-        # Ensure file write was not attempted
-        mock_open.assert_not_called()
-        
-        # Ensure xml2csv_metadata was not called
-        mock_xml2csv_metadata.assert_not_called()
-    
-    @patch('collect_tasks.prodcom_collect.requests.get')
-    @patch('collect_tasks.prodcom_collect.prettify_data')
-    @patch('builtins.open', new_callable=unittest.mock.mock_open)
-    @patch('collect_tasks.prodcom_collect.xml2csv_metadata')
-    def test_file_save_failure(self, mock_xml2csv_metadata, mock_open, mock_prettify_data, mock_requests_get):
-        # Mock the response from requests.get
-        mock_response = MagicMock()
-        mock_response.content = b'<xml>data</xml>'
-        mock_requests_get.return_value = mock_response
-        
-        # Mock prettified data
-        mock_prettify_data.return_value = '<xml>pretty data</xml>'
-        
-        # Simulate file open failure
-        mock_open.side_effect = IOError("Failed to open file")
-        
-        # Define the directory to save files
-        save_dir = 'mock_save_dir'
-        
-        # Call the function
-        get_datasets_info('dataflow', save_dir)
-        
-        # Ensure xml2csv_metadata was not called
-        mock_xml2csv_metadata.assert_not_called()
-        
-        # Check if file was attempted to be opened
-        mock_open.assert_called_once_with(f'{save_dir}/dataflow.xml', 'w', encoding='utf-8')
+            get_datasets_info('dataflow')
     
     
 
@@ -117,7 +92,12 @@ class TestPrettifyData(unittest.TestCase):
 
     def test_prettify_xml(self):
         data = '<root><name>John</name><age>30</age><city>New York</city></root>'
-        expected_output = '<?xml version="1.0" ?>\n<root>\n  <name>John</name>\n  <age>30</age>\n  <city>New York</city>\n</root>\n'
+        expected_output = "<?xml version='1.0' encoding='utf-8'?>\n<root>\n  <name>John</name>\n  <age>30</age>\n  <city>New York</city>\n</root>"
+        self.assertEqual(prettify_data(data, ".xml"), expected_output)
+
+    def test_prettify_xml_keeps_sdmx_prefixes(self):
+        data = b'<m:Structure xmlns:m="http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message"><m:Header/></m:Structure>'
+        expected_output = "<?xml version='1.0' encoding='utf-8'?>\n<m:Structure xmlns:m=\"http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message\">\n  <m:Header />\n</m:Structure>"
         self.assertEqual(prettify_data(data, ".xml"), expected_output)
 
 
@@ -151,6 +131,42 @@ class TestPrettifyData(unittest.TestCase):
 
 class TestSavePrettifiedXmlToZip(unittest.TestCase):
 
+    @patch('collect_tasks.prodcom_collect.ZipFile')  # Mock ZipFile
+    @patch('collect_tasks.prodcom_collect.prettify_data')  # Mock prettify_data
+    @patch('collect_tasks.prodcom_collect.logger')  # Mock logger
+    def test_save_raw_xml_to_zip_success(self, mock_logger, mock_prettify_data, mock_zipfile):
+        xml_data = b'<root><name>John</name><age>30</age><city>New York</city></root>'
+        output_zip_path = 'test.zip'
+        xml_filename = 'test.xml'
+
+        # Mock ZipFile context manager
+        mock_zip_file = MagicMock()
+        mock_zipfile.return_value.__enter__.return_value = mock_zip_file
+
+        # Call the function
+        save_prettified_xml_to_zip(xml_data, output_zip_path, xml_filename)
+
+        # The XML is stored as downloaded unless prettifying is requested
+        mock_prettify_data.assert_not_called()
+        mock_zipfile.assert_called_once_with(output_zip_path, 'w', zipfile.ZIP_STORED)
+        mock_zip_file.writestr.assert_called_once_with(xml_filename, xml_data)
+        mock_logger.info.assert_called_once_with(f"XML saved to {output_zip_path} as {xml_filename}")
+
+    @patch('collect_tasks.prodcom_collect.ZipFile')  # Mock ZipFile
+    @patch('collect_tasks.prodcom_collect.logger')  # Mock logger
+    def test_save_xml_to_zip_with_compression(self, mock_logger, mock_zipfile):
+        xml_data = b'<root><name>John</name><age>30</age><city>New York</city></root>'
+        mock_zip_file = MagicMock()
+        mock_zipfile.return_value.__enter__.return_value = mock_zip_file
+
+        # Call the function for an archive that has to be compressed
+        save_prettified_xml_to_zip(xml_data, 'test.zip', 'test.xml', zipfile.ZIP_DEFLATED)
+
+        # The requested compression is used instead of storing the XML
+        mock_zipfile.assert_called_once_with('test.zip', 'w', zipfile.ZIP_DEFLATED)
+        mock_zip_file.writestr.assert_called_once_with('test.xml', xml_data)
+
+    @patch('collect_tasks.prodcom_collect.prettify_xml', True)
     @patch('collect_tasks.prodcom_collect.ZipFile')  # Mock ZipFile
     @patch('collect_tasks.prodcom_collect.prettify_data')  # Mock prettify_data
     @patch('collect_tasks.prodcom_collect.logger')  # Mock logger
@@ -172,11 +188,11 @@ class TestSavePrettifiedXmlToZip(unittest.TestCase):
         mock_prettify_data.assert_called_once_with(xml_data, '.xml')
 
         # Check if ZipFile was used correctly
-        mock_zipfile.assert_called_once_with(output_zip_path, 'w', zipfile.ZIP_DEFLATED)
+        mock_zipfile.assert_called_once_with(output_zip_path, 'w', zipfile.ZIP_STORED)
         mock_zip_file.writestr.assert_called_once_with(xml_filename, prettified_xml)
 
         # Check if logger.info was called
-        mock_logger.info.assert_called_once_with(f"Prettified XML saved to {output_zip_path} as {xml_filename}")
+        mock_logger.info.assert_called_once_with(f"XML saved to {output_zip_path} as {xml_filename}")
 
     @patch('collect_tasks.prodcom_collect.ZipFile')  # Mock ZipFile
     @patch('collect_tasks.prodcom_collect.prettify_data')  # Mock prettify_data
@@ -196,7 +212,79 @@ class TestSavePrettifiedXmlToZip(unittest.TestCase):
         save_prettified_xml_to_zip(xml_data, output_zip_path, xml_filename)
 
         # Check if logger.error was called
-        mock_logger.error.assert_called_once_with("Failed to save prettified XML to zip: Write failed")
+        mock_logger.error.assert_called_once_with("Failed to save XML to zip: Write failed")
+
+###############################################################
+#                   Test load_datasets_info                   #
+###############################################################
+
+class TestLoadDatasetsInfo(unittest.TestCase):
+
+    def setUp(self):
+        datasets_info.clear()
+
+    @patch('collect_tasks.prodcom_collect.get_datasets_info')  # Mock get_datasets_info
+    def test_load_datasets_info_downloads_once(self, mock_get_datasets_info):
+        mock_get_datasets_info.return_value = {
+            '123': {'id': '123', 'structureURL': 'http://example.com/123'},
+            '456': {'id': '456', 'structureURL': 'http://example.com/456'}
+        }
+
+        first = load_datasets_info('codelist')
+        second = load_datasets_info('codelist')
+
+        # The catalogue is fetched a single time and reused
+        self.assertIs(first, second)
+        self.assertIs(first, mock_get_datasets_info.return_value)
+        mock_get_datasets_info.assert_called_once_with('codelist')
+
+
+###############################################################
+#                   Test load_structure_urls                  #
+###############################################################
+
+class TestLoadStructureUrls(unittest.TestCase):
+
+    def setUp(self):
+        structure_urls.clear()
+
+    @patch('collect_tasks.prodcom_collect.load_datasets_info')  # Mock load_datasets_info
+    def test_load_structure_urls_builds_once(self, mock_load_datasets_info):
+        mock_load_datasets_info.return_value = {
+            '123': {'id': '123', 'structureURL': 'http://example.com/123'},
+            '456': {'id': '456', 'structureURL': 'http://example.com/456'}
+        }
+
+        first = load_structure_urls('codelist')
+        second = load_structure_urls('codelist')
+
+        # The lookup is built a single time and reused
+        self.assertIs(first, second)
+        mock_load_datasets_info.assert_called_once_with('codelist')
+        self.assertEqual(first, {'123': 'http://example.com/123', '456': 'http://example.com/456'})
+
+
+###############################################################
+#                   Test fetch_structure_xml                  #
+###############################################################
+
+class TestFetchStructureXml(unittest.TestCase):
+
+    @patch('collect_tasks.prodcom_collect.tempfile.SpooledTemporaryFile')  # Mock SpooledTemporaryFile
+    @patch('collect_tasks.prodcom_collect.session.get')  # Mock session.get
+    def test_fetch_structure_xml_http_error(self, mock_session_get, mock_spooled_file):
+        # Return an error page instead of the structure
+        response = mock_session_get.return_value.__enter__.return_value
+        response.raise_for_status.side_effect = requests.HTTPError("503 Server Error")
+
+        # Call the function and expect the error to be raised
+        with self.assertRaises(requests.HTTPError):
+            fetch_structure_xml('123', 'codelist', {'123': 'http://example.com/123'})
+
+        # Nothing of the error page is kept and the spooled file is closed
+        response.iter_content.assert_not_called()
+        mock_spooled_file.return_value.close.assert_called_once()
+
 
 ###############################################################
 #                      Test get_metadata                      #
@@ -204,24 +292,24 @@ class TestSavePrettifiedXmlToZip(unittest.TestCase):
 
 class TestGetMetadata(unittest.TestCase):
 
+    def setUp(self):
+        datasets_info.clear()
+        structure_urls.clear()
+
     @patch('collect_tasks.prodcom_collect.get_datasets_info')  # Mock get_datasets_info
-    @patch('collect_tasks.prodcom_collect.pd.read_csv')  # Mock pd.read_csv
-    @patch('collect_tasks.prodcom_collect.os.remove')  # Mock os.remove
-    @patch('collect_tasks.prodcom_collect.requests.get')  # Mock requests.get
+    @patch('collect_tasks.prodcom_collect.session.get')  # Mock session.get
     @patch('collect_tasks.prodcom_collect.save_prettified_xml_to_zip')  # Mock save_prettified_xml_to_zip
     @patch('collect_tasks.prodcom_collect.logger')  # Mock logger
-    def test_get_metadata_success(self, mock_logger, mock_save_prettified_xml_to_zip, mock_requests_get, mock_os_remove, mock_read_csv, mock_get_datasets_info):
+    def test_get_metadata_success(self, mock_logger, mock_save_prettified_xml_to_zip, mock_session_get, mock_get_datasets_info):
         id = '123'
         metadata_type = 'codelist'
         save_dir = '/fake/dir'
-        
-        # Prepare mock CSV data
-        csv_data = pd.DataFrame({
-            'id': ['123', '456'],
-            'structureURL': ['http://example.com/123', 'http://example.com/456']
-        })
-        mock_read_csv.return_value = csv_data
-        mock_requests_get.return_value = MagicMock(content=b'fake_xml_content')
+        mock_get_datasets_info.return_value = {
+            '123': {'id': '123', 'structureURL': 'http://example.com/123'},
+            '456': {'id': '456', 'structureURL': 'http://example.com/456'}
+        }
+
+        mock_session_get.return_value.__enter__.return_value.iter_content.return_value = [b'fake_xml', b'_content']
         
         # Mock save_prettified_xml_to_zip to avoid actual file operations
         mock_save_prettified_xml_to_zip.return_value = None
@@ -230,16 +318,9 @@ class TestGetMetadata(unittest.TestCase):
         get_metadata(id, metadata_type, save_dir)
 
         # Assertions
-        mock_get_datasets_info.assert_called_once_with(metadata_type, '.')
-        mock_read_csv.assert_called_once_with(f'{metadata_type}.csv')
+        mock_get_datasets_info.assert_called_once_with(metadata_type)
 
-        # Assert that os.remove is called twice with the correct arguments
-        mock_os_remove.assert_has_calls([
-            call(f'{metadata_type}.csv'),
-            call(f'{metadata_type}.xml')
-        ], any_order=False)
-
-        mock_requests_get.assert_called_once_with('http://example.com/123', params={})
+        mock_session_get.assert_called_once_with('http://example.com/123', params={}, stream=True, timeout=30)
         mock_save_prettified_xml_to_zip.assert_called_once_with(
             b'fake_xml_content',
             Path(save_dir) / f"dim_{id}.zip",
@@ -249,169 +330,210 @@ class TestGetMetadata(unittest.TestCase):
 
 
     @patch('collect_tasks.prodcom_collect.get_datasets_info')  # Mock get_datasets_info
-    @patch('collect_tasks.prodcom_collect.pd.read_csv')  # Mock pd.read_csv
-    @patch('collect_tasks.prodcom_collect.os.remove')  # Mock os.remove
-    @patch('collect_tasks.prodcom_collect.requests.get')  # Mock requests.get
+    @patch('collect_tasks.prodcom_collect.session.get')  # Mock session.get
     @patch('collect_tasks.prodcom_collect.save_prettified_xml_to_zip')  # Mock save_prettified_xml_to_zip
     @patch('collect_tasks.prodcom_collect.logger')  # Mock logger
-    def test_get_metadata_no_matching_id(self, mock_logger, mock_save_prettified_xml_to_zip, mock_requests_get, mock_os_remove, mock_read_csv, mock_get_datasets_info):
+    def test_get_metadata_no_matching_id(self, mock_logger, mock_save_prettified_xml_to_zip, mock_session_get, mock_get_datasets_info):
         id = '999'
         metadata_type = 'codelist'
         save_dir = '/fake/dir'
-        csv_data = pd.DataFrame({
-            'id': ['123', '456'],
-            'structureURL': ['http://example.com/123', 'http://example.com/456']
-        })
-        mock_read_csv.return_value = csv_data
-        mock_os_remove.return_value = None
+        mock_get_datasets_info.return_value = {
+            '123': {'id': '123', 'structureURL': 'http://example.com/123'},
+            '456': {'id': '456', 'structureURL': 'http://example.com/456'}
+        }
 
         # Call the function
         get_metadata(id, metadata_type, save_dir)
 
         # Assertions
-        mock_get_datasets_info.assert_called_once_with(metadata_type, '.')
-        mock_read_csv.assert_called_once_with(f'{metadata_type}.csv')
-        mock_os_remove.assert_has_calls([
-            call(f'{metadata_type}.csv'),
-            call(f'{metadata_type}.xml')
-        ], any_order=False)
-        mock_requests_get.assert_not_called()
+        mock_get_datasets_info.assert_called_once_with(metadata_type)
+        mock_session_get.assert_not_called()
         mock_save_prettified_xml_to_zip.assert_not_called()
         mock_logger.warning.assert_called_once_with(f"No {metadata_type} found for id {id} in the CSV.")
 
     @patch('collect_tasks.prodcom_collect.get_datasets_info')  # Mock get_datasets_info
-    @patch('collect_tasks.prodcom_collect.pd.read_csv')  # Mock pd.read_csv
-    @patch('collect_tasks.prodcom_collect.os.remove')  # Mock os.remove
-    @patch('collect_tasks.prodcom_collect.requests.get')  # Mock requests.get
+    @patch('collect_tasks.prodcom_collect.session.get')  # Mock session.get
     @patch('collect_tasks.prodcom_collect.save_prettified_xml_to_zip')  # Mock save_prettified_xml_to_zip
     @patch('collect_tasks.prodcom_collect.logger')  # Mock logger
-    def test_get_metadata_exception(self, mock_logger, mock_save_prettified_xml_to_zip, mock_requests_get, mock_os_remove, mock_read_csv, mock_get_datasets_info):
+    def test_get_metadata_exception(self, mock_logger, mock_save_prettified_xml_to_zip, mock_session_get, mock_get_datasets_info):
         id = '123'
         metadata_type = 'codelist'
         save_dir = '/fake/dir'
-        mock_read_csv.side_effect = Exception("Read CSV failed")
+        mock_get_datasets_info.side_effect = Exception("Parse failed")
 
         # Call the function and expect it to handle the exception
         get_metadata(id, metadata_type, save_dir)
 
         # Assertions
-        mock_get_datasets_info.assert_called_once_with(metadata_type, '.')
-        mock_read_csv.assert_called_once_with(f'{metadata_type}.csv')
-        mock_os_remove.assert_not_called()
-        mock_requests_get.assert_not_called()
+        mock_get_datasets_info.assert_called_once_with(metadata_type)
+        mock_session_get.assert_not_called()
         mock_save_prettified_xml_to_zip.assert_not_called()
-        mock_logger.error.assert_called_once_with(f"An error occurred during the {metadata_type} request process: Read CSV failed")
+        mock_logger.error.assert_called_once_with(f"An error occurred during the {metadata_type} request process: Parse failed")
+
+    @patch('collect_tasks.prodcom_collect.get_datasets_info')  # Mock get_datasets_info
+    @patch('collect_tasks.prodcom_collect.session.get')  # Mock session.get
+    @patch('collect_tasks.prodcom_collect.save_prettified_xml_to_zip')  # Mock save_prettified_xml_to_zip
+    def test_get_metadata_with_urls(self, mock_save_prettified_xml_to_zip, mock_session_get, mock_get_datasets_info):
+        id = '123'
+        save_dir = '/fake/dir'
+        mock_session_get.return_value.__enter__.return_value.iter_content.return_value = [b'fake_xml', b'_content']
+
+        # Call the function with preloaded structure URLs
+        get_metadata(id, 'codelist', save_dir, {'123': 'http://example.com/123'})
+
+        # Assertions
+        mock_get_datasets_info.assert_not_called()
+        mock_session_get.assert_called_once_with('http://example.com/123', params={}, stream=True, timeout=30)
+        mock_save_prettified_xml_to_zip.assert_called_once_with(
+            b'fake_xml_content',
+            Path(save_dir) / f"dim_{id}.zip",
+            f"dim_{id}.xml"
+        )
 
 
 ###############################################################
-#                   Test get_data_version                     #
+#                     Test get_codelists                      #
 ###############################################################
 
-class TestGetDataVersion(unittest.TestCase):
+class TestGetCodelists(unittest.TestCase):
 
     @patch('collect_tasks.prodcom_collect.get_metadata')  # Mock get_metadata
-    @patch('collect_tasks.prodcom_collect.unzip_files')  # Mock unzip_files
-    @patch('collect_tasks.prodcom_collect.ET.parse')  # Mock ET.parse
-    @patch('collect_tasks.prodcom_collect.os.remove')  # Mock os.remove
-    def test_get_data_version_success(self, mock_os_remove, mock_et_parse, mock_unzip_files, mock_get_metadata):
-        dataset = 'test_dataset'
+    def test_get_codelists(self, mock_get_metadata):
+        save_dir = '/path/to/save/metadata'
+        urls = {'column1': 'http://example.com/column1', 'column2': 'http://example.com/column2'}
 
-        # Create a mock XML structure
-        mock_tree = MagicMock()
-        mock_root = ET.Element('root')
+        # Call the function
+        get_codelists(['column1', 'column2'], save_dir, urls)
 
-        # Create the necessary elements to match root[0][2]
-        mock_element = ET.Element('element')
-        mock_sub_element1 = ET.SubElement(mock_element, 'sub_element1')
-        mock_sub_element2 = ET.SubElement(mock_element, 'sub_element2')
-        mock_sub_element3 = ET.SubElement(mock_element, 'sub_element3')  # This will be root[0][2]
+        # One request per codelist id
+        mock_get_metadata.assert_has_calls([
+            call('column1', 'codelist', save_dir, urls),
+            call('column2', 'codelist', save_dir, urls)
+        ], any_order=True)
+        self.assertEqual(mock_get_metadata.call_count, 2)
 
-        mock_sub_element3.text = '2023-08-10T00:00:00Z'  # Ensure this element has the expected text
 
-        mock_root.append(mock_element)
-        mock_tree.getroot.return_value = mock_root
-        mock_et_parse.return_value = mock_tree
+###############################################################
+#                   Test iter_end_events                      #
+###############################################################
 
-        # Setup mock objects
-        mock_get_metadata.return_value = None
-        mock_unzip_files.return_value = None
+class TestIterEndEvents(unittest.TestCase):
+
+    @patch('collect_tasks.prodcom_collect.chunk_size', 8)  # Force several feeds
+    def test_iter_end_events_in_chunks(self):
+        structure = io.BytesIO(b'<Structure><Header><ID>IREF</ID></Header></Structure>')
+
+        # Call the function
+        events = list(iter_end_events(structure))
+
+        # Assertions
+        self.assertEqual([event for event, _ in events], ['end'] * 3)
+        self.assertEqual([item.tag for _, item in events], ['ID', 'Header', 'Structure'])
+
+    def test_iter_end_events_parse_error(self):
+        # Truncated XML is only reported once the parser is closed
+        with self.assertRaises(etree.ParseError):
+            list(iter_end_events(io.BytesIO(b'<Structure><Header>')))
+
+
+###############################################################
+#                   Test get_data_version                     #
+###############################################################
+
+class TestGetDataVersion(unittest.TestCase):
+
+    def setUp(self):
+        get_data_version.cache_clear()
+
+    @patch('collect_tasks.prodcom_collect.fetch_structure_xml')  # Mock fetch_structure_xml
+    @patch('collect_tasks.prodcom_collect.iter_end_events')  # Mock iter_end_events
+    def test_get_data_version_success(self, mock_iter_end_events, mock_fetch_structure_xml):
+        dataset = 'test_dataset'
+        structure = io.BytesIO(b'<Structure/>')
+        mock_fetch_structure_xml.return_value = structure
+
+        # Create the header elements in the order the parser reports their end
+        header = ET.Element('{http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message}Header')
+        header_id = ET.SubElement(header, '{http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message}ID')
+        prepared = ET.SubElement(header, '{http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message}Prepared')
+        prepared.text = '2023-08-10T00:00:00Z'  # Ensure this element has the expected text
+        later_element = ET.Element('{http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message}Structures')
+        events = iter([('end', header_id), ('end', prepared), ('end', header), ('end', later_element)])
+        mock_iter_end_events.return_value = events
 
         # Call the function
         version = get_data_version(dataset)
 
         # Assertions
         self.assertEqual(version, '20230810')
-        mock_get_metadata.assert_called_once_with(dataset, 'conceptscheme', '.')
-        mock_unzip_files.assert_called_once_with('.')
-        mock_et_parse.assert_called_once_with(f'dim_{dataset}.xml')
-        mock_os_remove.assert_has_calls([
-            unittest.mock.call(f'dim_{dataset}.xml'),
-            unittest.mock.call(f'dim_{dataset}.zip')
-        ])
+        self.assertEqual(next(events), ('end', later_element))  # Parsing stops after the header
+        mock_fetch_structure_xml.assert_called_once_with(dataset, 'conceptscheme')
 
-    @patch('collect_tasks.prodcom_collect.get_metadata')  # Mock get_metadata
-    @patch('collect_tasks.prodcom_collect.unzip_files')  # Mock unzip_files
-    @patch('collect_tasks.prodcom_collect.ET.parse')  # Mock ET.parse
-    @patch('collect_tasks.prodcom_collect.os.remove')  # Mock os.remove
-    def test_get_data_version_file_not_found(self, mock_os_remove, mock_et_parse, mock_unzip_files, mock_get_metadata):
+        # A second lookup of the same dataset is answered from the cache
+        self.assertEqual(get_data_version(dataset), '20230810')
+        mock_fetch_structure_xml.assert_called_once_with(dataset, 'conceptscheme')
+
+        # The structure is parsed straight from the downloaded file, which is closed afterwards
+        mock_iter_end_events.assert_called_once_with(structure)
+        self.assertTrue(structure.closed)
+
+    @patch('collect_tasks.prodcom_collect.fetch_structure_xml')  # Mock fetch_structure_xml
+    @patch('collect_tasks.prodcom_collect.iter_end_events')  # Mock iter_end_events
+    def test_get_data_version_structure_not_found(self, mock_iter_end_events, mock_fetch_structure_xml):
         dataset = 'test_dataset'
 
-        # Mock ET.parse to raise FileNotFoundError
-        mock_et_parse.side_effect = FileNotFoundError
+        # Mock fetch_structure_xml to find no structure
+        mock_fetch_structure_xml.return_value = None
 
-        # Call the function and expect it to raise FileNotFoundError
-        with self.assertRaises(FileNotFoundError):
-            get_data_version(dataset)
+        # Call the function
+        version = get_data_version(dataset)
 
         # Assertions
-        mock_get_metadata.assert_called_once_with(dataset, 'conceptscheme', '.')
-        mock_unzip_files.assert_called_once_with('.')
-        mock_et_parse.assert_called_once_with(f'dim_{dataset}.xml')
-        mock_os_remove.assert_not_called()
+        self.assertIsNone(version)
+        mock_fetch_structure_xml.assert_called_once_with(dataset, 'conceptscheme')
+        mock_iter_end_events.assert_not_called()
+
+    @patch('collect_tasks.prodcom_collect.fetch_structure_xml')  # Mock fetch_structure_xml
+    def test_get_data_version_header_without_prepared_date(self, mock_fetch_structure_xml):
+        # A prepared date outside of the header is not the version
+        mock_fetch_structure_xml.return_value = io.BytesIO(
+            b'<m:Structure xmlns:m="http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message">'
+            b'<m:Header><m:ID>IREF</m:ID></m:Header>'
+            b'<m:Structures><m:Prepared>2023-08-10T00:00:00Z</m:Prepared></m:Structures>'
+            b'</m:Structure>'
+        )
 
-    @patch('collect_tasks.prodcom_collect.get_metadata')  # Mock get_metadata
-    @patch('collect_tasks.prodcom_collect.unzip_files')  # Mock unzip_files
-    @patch('collect_tasks.prodcom_collect.ET.parse')  # Mock ET.parse
-    @patch('collect_tasks.prodcom_collect.os.remove')  # Mock os.remove
-    def test_get_data_version_xml_parse_error(self, mock_os_remove, mock_et_parse, mock_unzip_files, mock_get_metadata):
-        dataset = 'test_dataset'
+        self.assertIsNone(get_data_version('test_dataset'))
 
-        # Setup mock objects
-        mock_get_metadata.return_value = None
-        mock_unzip_files.return_value = None
+    @patch('collect_tasks.prodcom_collect.fetch_structure_xml')  # Mock fetch_structure_xml
+    def test_get_data_version_xml_parse_error(self, mock_fetch_structure_xml):
+        dataset = 'test_dataset'
 
-        # Mock ET.parse to raise ET.ParseError
-        mock_et_parse.side_effect = ET.ParseError
+        # Return malformed XML
+        mock_fetch_structure_xml.return_value = io.BytesIO(b'<Structure><Header>')
 
-        # Call the function and expect it to raise ET.ParseError
-        with self.assertRaises(ET.ParseError):
+        # Call the function and expect it to raise the parser's ParseError
+        with self.assertRaises(etree.ParseError):
             get_data_version(dataset)
 
         # Assertions
-        mock_get_metadata.assert_called_once_with(dataset, 'conceptscheme', '.')
-        mock_unzip_files.assert_called_once_with('.')
-        mock_et_parse.assert_called_once_with(f'dim_{dataset}.xml')
-        mock_os_remove.assert_not_called()
+        mock_fetch_structure_xml.assert_called_once_with(dataset, 'conceptscheme')
 
-    @patch('collect_tasks.prodcom_collect.get_metadata')  # Mock get_metadata
-    @patch('collect_tasks.prodcom_collect.unzip_files')  # Mock unzip_files
-    @patch('collect_tasks.prodcom_collect.ET.parse')  # Mock ET.parse
-    @patch('collect_tasks.prodcom_collect.os.remove')  # Mock os.remove
-    def test_get_data_version_exception(self, mock_os_remove, mock_et_parse, mock_unzip_files, mock_get_metadata):
+    @patch('collect_tasks.prodcom_collect.fetch_structure_xml')  # Mock fetch_structure_xml
+    @patch('collect_tasks.prodcom_collect.iter_end_events')  # Mock iter_end_events
+    def test_get_data_version_exception(self, mock_iter_end_events, mock_fetch_structure_xml):
         dataset = 'test_dataset'
 
         # Setup mock objects
-        mock_get_metadata.side_effect = Exception("Metadata fetch failed")
+        mock_fetch_structure_xml.side_effect = Exception("Metadata fetch failed")
 
         # Call the function and expect it to raise the Exception
         with self.assertRaises(Exception):
             get_data_version(dataset)
 
         # Assertions
-        mock_get_metadata.assert_called_once_with(dataset, 'conceptscheme', '.')
-        mock_unzip_files.assert_not_called()
-        mock_et_parse.assert_not_called()
-        mock_os_remove.assert_not_called()
+        mock_fetch_structure_xml.assert_called_once_with(dataset, 'conceptscheme')
+        mock_iter_end_events.assert_not_called()
 
 
 ###############################################################
@@ -420,54 +542,35 @@ class TestGetDataVersion(unittest.TestCase):
 
 class TestGetDataColumns(unittest.TestCase):
 
-    @patch('collect_tasks.prodcom_collect.get_metadata')  # Mock get_metadata
-    @patch('collect_tasks.prodcom_collect.unzip_files')  # Mock unzip_files
-    @patch('collect_tasks.prodcom_collect.ET.parse')  # Mock ET.parse
-    @patch('collect_tasks.prodcom_collect.os.remove')  # Mock os.remove
-    def test_get_data_columns_success(self, mock_os_remove, mock_et_parse, mock_unzip_files, mock_get_metadata):
-        dataset = 'test_dataset'
-        # Namespace dictionary to match the function's use
-        NS = {"m": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message",
-              "s": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure",
-              "c": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/common",
-              "xml": "http://www.w3.org/XML/1998/namespace"}
-
-        # Create a mock XML structure with the correct namespaces
-        mock_tree = MagicMock()
-        mock_root = ET.Element('root')
-
-        # Create `Enumeration` elements with the namespace
-        enumeration_element = ET.Element('{http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure}Enumeration')
-        item_element = ET.SubElement(enumeration_element, 'Item')
-        item_element.set('id', 'COLUMN_ID_1')  # First ID
-
-        enumeration_element2 = ET.Element('{http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure}Enumeration')
-        item_element2 = ET.SubElement(enumeration_element2, 'Item')
-        item_element2.set('id', 'COLUMN_ID_2')  # Second ID
-
-        # Append to root
-        mock_root.append(enumeration_element)
-        mock_root.append(enumeration_element2)
+    def setUp(self):
+        get_data_columns.cache_clear()
 
-        mock_tree.getroot.return_value = mock_root
-        mock_et_parse.return_value = mock_tree
+    @patch('collect_tasks.prodcom_collect.fetch_structure_xml')  # Mock fetch_structure_xml
+    def test_get_data_columns_success(self, mock_fetch_structure_xml):
+        dataset = 'test_dataset'
 
-        # Setup mock objects
-        mock_get_metadata.return_value = None
-        mock_unzip_files.return_value = None
+        # Create a structure with `Enumeration` elements in the structure namespace
+        mock_fetch_structure_xml.return_value = io.BytesIO(
+            b'<s:Concepts xmlns:s="http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure">'
+            b'<s:Concept><s:Enumeration><Item id="COLUMN_ID_1"/></s:Enumeration></s:Concept>'
+            b'<s:Concept/>'
+            b'<s:Concept><s:Enumeration><Item id="COLUMN_ID_2"/></s:Enumeration></s:Concept>'
+            b'</s:Concepts>'
+        )
 
         # Call the function
         columns = get_data_columns(dataset)
 
         # Assertions
         self.assertEqual(columns, ['COLUMN_ID_1', 'COLUMN_ID_2'])  # Expect the IDs to be in the list
-        mock_get_metadata.assert_called_once_with(dataset, 'conceptscheme', '.')
-        mock_unzip_files.assert_called_once_with('.')
-        mock_et_parse.assert_called_once_with(f'dim_{dataset}.xml')
-        mock_os_remove.assert_has_calls([
-            unittest.mock.call(f'dim_{dataset}.xml'),
-            unittest.mock.call(f'dim_{dataset}.zip')
-        ])
+        mock_fetch_structure_xml.assert_called_once_with(dataset, 'conceptscheme')
+
+    @patch('collect_tasks.prodcom_collect.fetch_structure_xml')  # Mock fetch_structure_xml
+    def test_get_data_columns_structure_not_found(self, mock_fetch_structure_xml):
+        mock_fetch_structure_xml.return_value = None
+
+        # No structure means no columns
+        self.assertEqual(get_data_columns('test_dataset'), [])
 
 
 ###############################################################
@@ -476,30 +579,24 @@ class TestGetDataColumns(unittest.TestCase):
 
 class TestGetDataDescription(unittest.TestCase):
 
-    @patch('collect_tasks.prodcom_collect.os.remove')  # Mock os.remove
-    @patch('collect_tasks.prodcom_collect.pd.read_csv')  # Mock pd.read_csv
+    def setUp(self):
+        get_data_description.cache_clear()
+        datasets_info.clear()
+
     @patch('collect_tasks.prodcom_collect.get_datasets_info')  # Mock get_datasets_info
-    def test_get_data_description_success(self, mock_get_datasets_info, mock_read_csv, mock_os_remove):
+    def test_get_data_description_success(self, mock_get_datasets_info):
         dataset = 'test_dataset'
-
-        # Mock the DataFrame returned by pd.read_csv
-        mock_df = pd.DataFrame({
-            'id': ['test_dataset', 'other_dataset'],
-            'name': ['Test Dataset Description', 'Other Dataset Description']
-        })
-        mock_read_csv.return_value = mock_df
+        mock_get_datasets_info.return_value = {
+            'test_dataset': {'id': 'test_dataset', 'name': 'Test Dataset Description'},
+            'other_dataset': {'id': 'other_dataset', 'name': 'Other Dataset Description'}
+        }
 
         # Call the function
         description = get_data_description(dataset)
 
         # Assertions
         self.assertEqual(description.strip(), 'Test Dataset Description')  # The returned description should match
-        mock_get_datasets_info.assert_called_once_with('dataflow', '.')  # Ensure get_datasets_info was called with the correct arguments
-        mock_read_csv.assert_called_once_with('dataflow.csv')  # Ensure read_csv was called with the correct file name
-        mock_os_remove.assert_has_calls([
-            call('dataflow.csv'),
-            call('dataflow.xml')
-        ], any_order=False)
+        mock_get_datasets_info.assert_called_once_with('dataflow')  # Ensure get_datasets_info was called with the correct arguments
 
 
 ###############################################################
@@ -539,7 +636,9 @@ class TestProdcomCollect(unittest.TestCase):
     @patch('collect_tasks.prodcom_collect.get_data_description')  # Mock get_data_description
     @patch('collect_tasks.prodcom_collect.get_data')  # Mock get_data
     @patch('collect_tasks.prodcom_collect.get_metadata')  # Mock get_metadata
-    def test_prodcom_collect_no_previous_version(self, mock_get_metadata, mock_get_data, mock_get_data_description, mock_get_data_columns, mock_get_data_version):
+    @patch('collect_tasks.prodcom_collect.get_codelists')  # Mock get_codelists
+    @patch('collect_tasks.prodcom_collect.load_structure_urls')  # Mock load_structure_urls
+    def test_prodcom_collect_no_previous_version(self, mock_load_structure_urls, mock_get_codelists, mock_get_metadata, mock_get_data, mock_get_data_description, mock_get_data_columns, mock_get_data_version):
         # Setup mock objects
         mock_repo = MagicMock()
         mock_repo.get_latest_version.side_effect = Exception("No previous version")  # Simulate no previous version
@@ -559,6 +658,11 @@ class TestProdcomCollect(unittest.TestCase):
         mock_get_data.assert_called()
         mock_get_metadata.assert_called()
 
+        # All codelists of a dataset are requested in one call, with the structure URLs passed down
+        self.assertEqual(mock_get_codelists.call_count, 2)
+        mock_get_codelists.assert_called_with(['column1', 'column2'], unittest.mock.ANY, mock_load_structure_urls.return_value)
+        self.assertNotIn('codelist', [c.args[1] for c in mock_get_metadata.call_args_list])
+
         # Get the number of datasets used in the test
         datasets = ['dataset1', 'dataset2']
 
@@ -570,7 +674,9 @@ class TestProdcomCollect(unittest.TestCase):
     @patch('collect_tasks.prodcom_collect.get_data_description')  # Mock get_data_description
     @patch('collect_tasks.prodcom_collect.get_data')  # Mock get_data
     @patch('collect_tasks.prodcom_collect.get_metadata')  # Mock get_metadata
-    def test_prodcom_collect_existing_version_no_update(self, mock_get_metadata, mock_get_data, mock_get_data_description, mock_get_data_columns, mock_get_data_version):
+    @patch('collect_tasks.prodcom_collect.load_structure_urls')  # Mock load_structure_urls
+    @patch('collect_tasks.prodcom_collect.get_last_modified', return_value=None)  # Mock get_last_modified
+    def test_prodcom_collect_existing_version_no_update(self, mock_get_last_modified, mock_load_structure_urls, mock_get_metadata, mock_get_data, mock_get_data_description, mock_get_data_columns, mock_get_data_version):
         # Setup mock objects
         mock_repo = MagicMock()
         mock_repo.get_latest_version.return_value = '20230810'  # Latest version matches online version
@@ -590,13 +696,16 @@ class TestProdcomCollect(unittest.TestCase):
         mock_repo.add_or_update_resource_list.assert_not_called()
         mock_get_data.assert_not_called()
         mock_get_metadata.assert_not_called()
+        mock_load_structure_urls.assert_not_called()
 
     @patch('collect_tasks.prodcom_collect.get_data_version')  # Mock get_data_version
     @patch('collect_tasks.prodcom_collect.get_data_columns')  # Mock get_data_columns
     @patch('collect_tasks.prodcom_collect.get_data_description')  # Mock get_data_description
     @patch('collect_tasks.prodcom_collect.get_data')  # Mock get_data
     @patch('collect_tasks.prodcom_collect.get_metadata')  # Mock get_metadata
-    def test_prodcom_collect_existing_version_update(self, mock_get_metadata, mock_get_data, mock_get_data_description, mock_get_data_columns, mock_get_data_version):
+    @patch('collect_tasks.prodcom_collect.load_structure_urls')  # Mock load_structure_urls
+    @patch('collect_tasks.prodcom_collect.get_last_modified', return_value=None)  # Mock get_last_modified
+    def test_prodcom_collect_existing_version_update(self, mock_get_last_modified, mock_load_structure_urls, mock_get_metadata, mock_get_data, mock_get_data_description, mock_get_data_columns, mock_get_data_version):
         # Setup mock objects
         mock_repo = MagicMock()
         mock_repo.get_latest_version.return_value = '20230809'  # Simulate an older version exists
@@ -622,6 +731,121 @@ class TestProdcomCollect(unittest.TestCase):
         # Ensure add_or_update_resource_list is called once for each dataset
         self.assertEqual(mock_repo.add_or_update_resource_list.call_count, len(datasets))
 
+    @patch('collect_tasks.prodcom_collect.get_data_version')  # Mock get_data_version
+    @patch('collect_tasks.prodcom_collect.get_data_columns')  # Mock get_data_columns
+    @patch('collect_tasks.prodcom_collect.get_data_description')  # Mock get_data_description
+    @patch('collect_tasks.prodcom_collect.get_data')  # Mock get_data
+    @patch('collect_tasks.prodcom_collect.get_metadata')  # Mock get_metadata
+    @patch('collect_tasks.prodcom_collect.get_last_modified', return_value='20230801')  # Mock get_last_modified
+    def test_prodcom_collect_not_modified_since_latest_version(self, mock_get_last_modified, mock_get_metadata, mock_get_data, mock_get_data_description, mock_get_data_columns, mock_get_data_version):
+        # Setup mock objects
+        mock_repo = MagicMock()
+        mock_repo.get_latest_version.return_value = '20230810'  # Collected after the last modification
+        mock_config = MagicMock()
+        mock_config.resource_repository = mock_repo
+        mock_config.schemas.DataResource = MagicMock()
+
+        # Call the function
+        did_update = prodcom_collect(mock_config)
+
+        # Assertions
+        self.assertFalse(did_update)
+        self.assertEqual(mock_get_last_modified.call_count, 2)
+        mock_get_data_version.assert_not_called()
+        mock_get_data_columns.assert_not_called()
+        mock_get_data_description.assert_not_called()
+        mock_get_data.assert_not_called()
+        mock_get_metadata.assert_not_called()
+        mock_repo.add_or_update_resource_list.assert_not_called()
+
+    @patch('collect_tasks.prodcom_collect.get_data_version')  # Mock get_data_version
+    @patch('collect_tasks.prodcom_collect.get_data_columns')  # Mock get_data_columns
+    @patch('collect_tasks.prodcom_collect.get_data_description')  # Mock get_data_description
+    @patch('collect_tasks.prodcom_collect.get_data')  # Mock get_data
+    @patch('collect_tasks.prodcom_collect.get_metadata')  # Mock get_metadata
+    @patch('collect_tasks.prodcom_collect.get_codelists')  # Mock get_codelists
+    @patch('collect_tasks.prodcom_collect.load_structure_urls')  # Mock load_structure_urls
+    @patch('collect_tasks.prodcom_collect.get_last_modified', return_value='20230810')  # Mock get_last_modified
+    def test_prodcom_collect_modified_on_latest_version_day(self, mock_get_last_modified, mock_load_structure_urls, mock_get_codelists, mock_get_metadata, mock_get_data, mock_get_data_description, mock_get_data_columns, mock_get_data_version):
+        # Setup mock objects, the data changed on the day of the latest version
+        mock_repo = MagicMock()
+        mock_repo.get_latest_version.return_value = '20230810'
+        mock_config = MagicMock()
+        mock_config.resource_repository = mock_repo
+        mock_config.schemas.DataResource = MagicMock()
+
+        mock_get_data_version.return_value = '20230810'
+        mock_get_data_columns.return_value = ['column1', 'column2']
+
+        # Call the function
+        did_update = prodcom_collect(mock_config)
+
+        # The same date does not skip the structure check, which finds the version unchanged
+        self.assertFalse(did_update)
+        self.assertEqual(mock_get_data_version.call_count, 2)
+        mock_get_data.assert_not_called()
+        mock_repo.add_or_update_resource_list.assert_not_called()
+
+    @patch('collect_tasks.prodcom_collect.get_data_version')  # Mock get_data_version
+    @patch('collect_tasks.prodcom_collect.get_data_columns')  # Mock get_data_columns
+    @patch('collect_tasks.prodcom_collect.get_data_description')  # Mock get_data_description
+    @patch('collect_tasks.prodcom_collect.get_data')  # Mock get_data
+    @patch('collect_tasks.prodcom_collect.get_metadata')  # Mock get_metadata
+    @patch('collect_tasks.prodcom_collect.get_codelists')  # Mock get_codelists
+    @patch('collect_tasks.prodcom_collect.load_structure_urls')  # Mock load_structure_urls
+    def test_prodcom_collect_failed_dataset(self, mock_load_structure_urls, mock_get_codelists, mock_get_metadata, mock_get_data, mock_get_data_description, mock_get_data_columns, mock_get_data_version):
+        # Setup mock objects, the download of DS-056120 fails
+        mock_repo = MagicMock()
+        mock_repo.get_latest_version.side_effect = Exception("No previous version")
+        mock_config = MagicMock()
+        mock_config.resource_repository = mock_repo
+        mock_config.schemas.DataResource.side_effect = lambda **kwargs: SimpleNamespace(**kwargs)
+
+        mock_get_data_version.return_value = '20230810'
+        mock_get_data_columns.return_value = ['column1', 'column2']
+        mock_get_data_description.return_value = 'Test Dataset Description'
+        def get_data(dataset, location):
+            if dataset == 'DS-056120':
+                raise Exception("500")
+        mock_get_data.side_effect = get_data
+
+        # Call the function
+        did_update = prodcom_collect(mock_config)
+
+        # The other dataset is still registered
+        self.assertTrue(did_update)
+        self.assertEqual(mock_repo.add_or_update_resource_list.call_count, 1)
+
+
+###############################################################
+#                   Test get_last_modified                    #
+###############################################################
+
+class TestGetLastModified(unittest.TestCase):
+
+    @patch('collect_tasks.prodcom_collect.session.head')  # Mock session.head
+    def test_get_last_modified(self, mock_session_head):
+        mock_session_head.return_value = MagicMock(headers={'Last-Modified': 'Thu, 10 Aug 2023 08:00:00 GMT'})
+
+        self.assertEqual(get_last_modified('test_dataset'), '20230810')
+        mock_session_head.assert_called_once_with(
+            'https://ec.europa.eu/eurostat/api/comext/dissemination/sdmx/2.1/data/test_dataset/?format=SDMX-CSV&compressed=true&i',
+            allow_redirects=True,
+            timeout=30
+        )
+
+    @patch('collect_tasks.prodcom_collect.session.head')  # Mock session.head
+    def test_get_last_modified_missing_header(self, mock_session_head):
+        mock_session_head.return_value = MagicMock(headers={})
+
+        self.assertIsNone(get_last_modified('test_dataset'))
+
+    @patch('collect_tasks.prodcom_collect.session.head')  # Mock session.head
+    def test_get_last_modified_request_failure(self, mock_session_head):
+        mock_session_head.side_effect = requests.RequestException("HEAD failed")
+
+        self.assertIsNone(get_last_modified('test_dataset'))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,440 @@
+import unittest
+from unittest.mock import patch, MagicMock, call
+from collect_tasks.unido_collect import session, get_cached, get_metadata, post_data, map_bounded, get_data_values_from_meta, get_data_version, download_unido_data, unido_collect, orjson, ijson
+import io
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+
+# Build a response with a json body
+def make_response(data, status_code=200, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(data).encode('utf-8')
+    response.headers.update(headers or {})
+    return response
+
+
+# Build a response whose json body is only readable as a stream
+def make_stream_response(data, status_code=200):
+    response = requests.Response()
+    response.status_code = status_code
+    response.raw = io.BytesIO(json.dumps(data).encode('utf-8'))
+    return response
+
+
+# Answer data requests with one row per country and variable
+def post_rows(url, json, timeout, **kwargs):
+    if 'variableCodes' in json:
+        return make_response({'error': 'variableCodes is not supported'}, status_code=400)
+    return make_response({'data': [{'value': f"{json['countryCode']}{json['variableCode']}"}]})
+
+
+meta_data = {
+    'id': 'X',
+    'production_year': '2024',
+    'periods': [2020],
+    'countries': [{'c': 'DK'}, {'c': 'SE'}],
+    'activities': [{'c': 'A'}],
+    'variables': [{'c': 'V1'}, {'c': 'V2'}]
+}
+
+
+###############################################################
+#                        Test session                         #
+###############################################################
+
+class TestSession(unittest.TestCase):
+
+    def test_session_retries_throttled_requests(self):
+        retry = session.get_adapter('https://stat.unido.org').max_retries
+
+        # Throttled and failed data requests are retried as well
+        self.assertIn(429, retry.status_forcelist)
+        self.assertIn('POST', retry.allowed_methods)
+        self.assertGreater(retry.backoff_factor, 0)
+
+
+###############################################################
+#                 Test get_cached / get_metadata              #
+###############################################################
+
+class TestGetMetadata(unittest.TestCase):
+
+    def setUp(self):
+        get_metadata.cache_clear()
+
+    @patch('collect_tasks.unido_collect.session.get')  # Mock session.get
+    def test_get_metadata_is_memoised(self, mock_session_get):
+        mock_session_get.return_value = make_response(meta_data)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with patch('collect_tasks.unido_collect.cache_dir', tmp_dir):
+                get_metadata('INDSTAT')
+                get_metadata('INDSTAT')
+
+                # Without validators nothing is cached on disk
+                self.assertEqual(os.listdir(tmp_dir), [])
+
+        mock_session_get.assert_called_once()
+
+    @patch('collect_tasks.unido_collect.session.get')  # Mock session.get
+    def test_get_metadata_revalidates_cached_response(self, mock_session_get):
+        first = make_response(meta_data, headers={'ETag': '"abc"'})
+        not_modified = requests.Response()
+        not_modified.status_code = 304
+        not_modified._content = b''
+        mock_session_get.side_effect = [first, not_modified]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with patch('collect_tasks.unido_collect.cache_dir', tmp_dir):
+                get_metadata('INDSTAT')
+                get_metadata.cache_clear()
+                data = get_metadata('INDSTAT')
+
+        # The second request is conditional and its body comes from the cache
+        url = 'https://stat.unido.org/portal/dataset/getDataset/INDSTAT'
+        self.assertEqual(mock_session_get.call_args_list, [
+            call(url, timeout=30, headers={}),
+            call(url, timeout=30, headers={'If-None-Match': '"abc"'})
+        ])
+        self.assertEqual(data, meta_data)
+
+    @patch('collect_tasks.unido_collect.session.get')  # Mock session.get
+    def test_get_cached_ignores_unreadable_validators(self, mock_session_get):
+        mock_session_get.return_value = make_response(meta_data, headers={'ETag': '"abc"'})
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with patch('collect_tasks.unido_collect.cache_dir', tmp_dir):
+                get_cached('http://example.com', 'meta_INDSTAT')
+                # Only the body and the validators are left, no temporary files
+                self.assertEqual(sorted(os.listdir(tmp_dir)), ['meta_INDSTAT.json', 'meta_INDSTAT.validators.json'])
+
+                # Simulate validators that are empty while they are rewritten
+                Path(tmp_dir, 'meta_INDSTAT.validators.json').write_text('')
+                content = get_cached('http://example.com', 'meta_INDSTAT')
+
+        # The request falls back to a plain GET
+        self.assertEqual(mock_session_get.call_args_list[1], call('http://example.com', timeout=30, headers={}))
+        self.assertEqual(json.loads(content), meta_data)
+
+
+###############################################################
+#                       Test post_data                        #
+###############################################################
+
+@unittest.skipIf(ijson is None, "ijson is not installed")
+class TestPostData(unittest.TestCase):
+
+    @patch('collect_tasks.unido_collect.session.post')  # Mock session.post
+    def test_post_data_streams_rows(self, mock_session_post):
+        mock_session_post.return_value = make_stream_response({'data': [{'value': 1.5}, {'value': 2}]})
+
+        # Call the function
+        rows = post_data({'countryCode': 'DK'})
+
+        # The rows are parsed from the raw body, with decimals as float like the json module
+        self.assertEqual(rows, [{'value': 1.5}, {'value': 2}])
+        self.assertIsInstance(rows[0]['value'], float)
+        mock_session_post.assert_called_once_with(
+            'https://stat.unido.org/portal/dataset/getData', json={'countryCode': 'DK'}, timeout=60, stream=True
+        )
+
+    @patch('collect_tasks.unido_collect.session.post')  # Mock session.post
+    def test_post_data_raises_on_error_response(self, mock_session_post):
+        mock_session_post.return_value = make_stream_response({'error': 'unavailable'}, status_code=503)
+
+        # An error body has no rows, but must not pass as an empty result
+        with self.assertRaises(requests.HTTPError):
+            post_data({'countryCode': 'DK'})
+
+
+###############################################################
+#                  Test get_data_values_from_meta             #
+###############################################################
+
+# The responses are read whole, as ijson would stream them from the raw body
+@patch('collect_tasks.unido_collect.ijson', None)
+class TestGetDataValuesFromMeta(unittest.TestCase):
+
+    @patch('collect_tasks.unido_collect.session.post', side_effect=post_rows)  # Mock session.post
+    def test_rows_in_task_order(self, mock_session_post):
+        # Call the function
+        chunks = list(get_data_values_from_meta(meta_data, ['A'], ['DK', 'SE'], ['V1', 'V2'], [2020]))
+
+        # One list of rows per request, tagged with its country and variable
+        self.assertEqual(chunks, [
+            [{'value': 'DKV1', 'cc': 'DK', 'vc': 'V1'}],
+            [{'value': 'DKV2', 'cc': 'DK', 'vc': 'V2'}],
+            [{'value': 'SEV1', 'cc': 'SE', 'vc': 'V1'}],
+            [{'value': 'SEV2', 'cc': 'SE', 'vc': 'V2'}]
+        ])
+        mock_session_post.assert_any_call(
+            'https://stat.unido.org/portal/dataset/getData',
+            json={'datasetId': 'X', 'activityCodes': ['A'], 'periods': [2020], 'countryCode': 'DK', 'variableCode': 'V1'},
+            timeout=60
+        )
+
+    @patch('collect_tasks.unido_collect.session.post', side_effect=post_rows)  # Mock session.post
+    def test_country_progress_logged_at_info(self, mock_session_post):
+        # Call the function
+        with self.assertLogs('root', level='INFO') as logs:
+            list(get_data_values_from_meta(meta_data, ['A'], ['DK', 'SE'], ['V1', 'V2'], [2020]))
+
+        # Each country is logged once when it starts and once when it finishes, not per request
+        self.assertEqual([record.getMessage() for record in logs.records if 'country' in record.getMessage()], [
+            'Starting process for country: DK',
+            'Finished process for country: DK',
+            'Starting process for country: SE',
+            'Finished process for country: SE'
+        ])
+
+    @patch('collect_tasks.unido_collect.batch_variables', True)
+    @patch('collect_tasks.unido_collect.session.post', side_effect=post_rows)  # Mock session.post
+    def test_batched_request_falls_back(self, mock_session_post):
+        # Call the function, the server rejects the batched request
+        rows = [row for chunk in get_data_values_from_meta(meta_data, ['A'], ['DK', 'SE'], ['V1', 'V2'], [2020]) for row in chunk]
+
+        # The probe is rejected, so every country is requested one variable at a time
+        self.assertEqual([row['value'] for row in rows], ['DKV1', 'DKV2', 'SEV1', 'SEV2'])
+        self.assertEqual(mock_session_post.call_count, 5)
+
+    @patch('collect_tasks.unido_collect.batch_variables', True)
+    @patch('collect_tasks.unido_collect.session.post')  # Mock session.post
+    def test_batched_request_empty_probe_falls_back(self, mock_session_post):
+        # The server ignores the list of variables and answers the batched request with no rows
+        mock_session_post.side_effect = lambda url, json, timeout, **kwargs: (
+            make_response({'data': []}) if 'variableCodes' in json else post_rows(url, json, timeout)
+        )
+
+        # Call the function
+        rows = [row for chunk in get_data_values_from_meta(meta_data, ['A'], ['DK', 'SE'], ['V1', 'V2'], [2020]) for row in chunk]
+
+        # The empty probe does not count as accepted, so no rows are lost
+        self.assertEqual([row['value'] for row in rows], ['DKV1', 'DKV2', 'SEV1', 'SEV2'])
+        self.assertEqual(mock_session_post.call_count, 5)
+
+    @patch('collect_tasks.unido_collect.batch_variables', True)
+    @patch('collect_tasks.unido_collect.session.post')  # Mock session.post
+    def test_batched_request_accepted(self, mock_session_post):
+        mock_session_post.side_effect = lambda url, json, timeout, **kwargs: make_response(
+            {'data': [{'variableCode': vc, 'value': json['countryCode'] + vc} for vc in json['variableCodes']]}
+        )
+
+        # Call the function
+        chunks = list(get_data_values_from_meta(meta_data, ['A'], ['DK', 'SE'], ['V1', 'V2'], [2020]))
+
+        # One request per country, with the variable code of each row as vc
+        self.assertEqual(mock_session_post.call_count, 2)
+        self.assertEqual([(row['cc'], row['vc']) for row in chunks[1]], [('SE', 'V1'), ('SE', 'V2')])
+
+    @patch('collect_tasks.unido_collect.session.post')  # Mock session.post
+    def test_failed_request_raises_after_the_others(self, mock_session_post):
+        mock_session_post.side_effect = lambda url, json, timeout, **kwargs: (
+            make_response({'error': 'unavailable'}, status_code=503) if json['countryCode'] == 'SE' and json['variableCode'] == 'V2'
+            else post_rows(url, json, timeout)
+        )
+        chunks = []
+
+        # Call the function and expect it to raise once the other requests are done
+        with self.assertRaises(RuntimeError):
+            for chunk in get_data_values_from_meta(meta_data, ['A'], ['DK', 'SE'], ['V1', 'V2'], [2020]):
+                chunks.append(chunk)
+
+        self.assertEqual(len(chunks), 3)
+
+
+###############################################################
+#                       Test map_bounded                      #
+###############################################################
+
+class TestMapBounded(unittest.TestCase):
+
+    @patch('collect_tasks.unido_collect.max_workers', 2)
+    def test_map_bounded_keeps_order_and_window(self):
+        submitted = []
+        def work(item):
+            submitted.append(item)
+            time.sleep(0.001)
+            return item * 2
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = map_bounded(executor, work, range(20))
+            first = next(results)
+
+            # No more than twice the number of workers are submitted ahead of the consumer
+            self.assertLessEqual(len(submitted), 4)
+            self.assertEqual([first] + list(results), [i * 2 for i in range(20)])
+
+
+###############################################################
+#                    Test get_data_version                    #
+###############################################################
+
+class TestGetDataVersion(unittest.TestCase):
+
+    @unittest.skipIf(ijson is None, "ijson is not installed")
+    @patch('collect_tasks.unido_collect.get_metadata')  # Mock get_metadata
+    @patch('collect_tasks.unido_collect.session.get')  # Mock session.get
+    def test_get_data_version_streams_production_year(self, mock_session_get, mock_get_metadata):
+        mock_session_get.return_value = make_stream_response(meta_data)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with patch('collect_tasks.unido_collect.cache_dir', tmp_dir):
+                version = get_data_version('INDSTAT', stream=True)
+
+        # The production year is read from the stream, without fetching the whole metadata
+        self.assertEqual(version, '2024')
+        mock_session_get.assert_called_once_with('https://stat.unido.org/portal/dataset/getDataset/INDSTAT', timeout=30, stream=True)
+        mock_get_metadata.assert_not_called()
+
+    @patch('collect_tasks.unido_collect.get_metadata', return_value=meta_data)  # Mock get_metadata
+    @patch('collect_tasks.unido_collect.session.get')  # Mock session.get
+    def test_get_data_version_uses_cached_metadata(self, mock_session_get, mock_get_metadata):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            Path(tmp_dir, 'meta_INDSTAT.json').write_text(json.dumps(meta_data))
+            with patch('collect_tasks.unido_collect.cache_dir', tmp_dir):
+                version = get_data_version('INDSTAT', stream=True)
+
+        # A cached copy is revalidated through get_metadata instead of downloaded again
+        self.assertEqual(version, '2024')
+        mock_session_get.assert_not_called()
+        mock_get_metadata.assert_called_once_with('INDSTAT')
+
+
+###############################################################
+#                   Test download_unido_data                  #
+###############################################################
+
+# The mocked responses have no raw body to stream
+@patch('collect_tasks.unido_collect.ijson', None)
+class TestDownloadUnidoData(unittest.TestCase):
+
+    @patch('collect_tasks.unido_collect.get_metadata', return_value=meta_data)  # Mock get_metadata
+    @patch('collect_tasks.unido_collect.session.post')  # Mock session.post
+    def test_download_writes_valid_json(self, mock_session_post, mock_get_metadata):
+        # The requests for SE return no rows
+        mock_session_post.side_effect = lambda url, json, timeout, **kwargs: (
+            make_response({'data': []}) if json['countryCode'] == 'SE' else post_rows(url, json, timeout)
+        )
+
+        # The output is the same with and without orjson
+        for orjson_module in (orjson, None):
+            with self.subTest(orjson=orjson_module), tempfile.TemporaryDirectory() as tmp_dir:
+                with patch('collect_tasks.unido_collect.orjson', orjson_module):
+                    download_unido_data('INDSTAT', tmp_dir)
+
+                # The output is a valid array of the rows that were returned
+                with open(Path(tmp_dir) / 'fact_INDSTAT.json', encoding='utf-8') as f:
+                    rows = json.load(f)
+                self.assertEqual(rows, [
+                    {'value': 'DKV1', 'cc': 'DK', 'vc': 'V1'},
+                    {'value': 'DKV2', 'cc': 'DK', 'vc': 'V2'}
+                ])
+                self.assertEqual(os.listdir(tmp_dir), ['fact_INDSTAT.json'])
+
+    @patch('collect_tasks.unido_collect.get_metadata', return_value=meta_data)  # Mock get_metadata
+    @patch('collect_tasks.unido_collect.session.post')  # Mock session.post
+    def test_download_all_responses_empty(self, mock_session_post, mock_get_metadata):
+        mock_session_post.return_value = make_response({'data': []})
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            download_unido_data('INDSTAT', tmp_dir)
+
+            with open(Path(tmp_dir) / 'fact_INDSTAT.json', encoding='utf-8') as f:
+                self.assertEqual(json.load(f), [])
+
+    @patch('collect_tasks.unido_collect.get_metadata', return_value=meta_data)  # Mock get_metadata
+    @patch('collect_tasks.unido_collect.session.post')  # Mock session.post
+    def test_download_failed_request_keeps_previous_output(self, mock_session_post, mock_get_metadata):
+        mock_session_post.side_effect = lambda url, json, timeout, **kwargs: (
+            make_response({'error': 'unavailable'}, status_code=503) if json['countryCode'] == 'SE' else post_rows(url, json, timeout)
+        )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            Path(tmp_dir, 'fact_INDSTAT.json').write_text('[]')
+
+            # Call the function and expect it to raise
+            with self.assertRaises(RuntimeError):
+                download_unido_data('INDSTAT', tmp_dir)
+
+            # The previous output is untouched and the partial file is left behind
+            self.assertEqual(Path(tmp_dir, 'fact_INDSTAT.json').read_text(), '[]')
+            self.assertTrue(Path(tmp_dir, 'fact_INDSTAT.json.part').exists())
+
+
+###############################################################
+#                      Test unido_collect                     #
+###############################################################
+
+class TestUnidoCollect(unittest.TestCase):
+
+    def make_config(self, latest_version):
+        mock_repo = MagicMock()
+        if isinstance(latest_version, Exception):
+            mock_repo.get_latest_version.side_effect = latest_version
+        else:
+            mock_repo.get_latest_version.return_value = latest_version
+        mock_config = MagicMock()
+        mock_config.resource_repository = mock_repo
+        mock_config.schemas.DataResource.side_effect = lambda **kwargs: SimpleNamespace(**kwargs)
+        return mock_config
+
+    @patch('collect_tasks.unido_collect.get_data_version', return_value='2024')  # Mock get_data_version
+    @patch('collect_tasks.unido_collect.download_unido_data')  # Mock download_unido_data
+    def test_unido_collect_up_to_date(self, mock_download_unido_data, mock_get_data_version):
+        mock_config = self.make_config('2024')
+
+        # Call the function
+        did_update = unido_collect(mock_config)
+
+        # Nothing is downloaded or registered, and the version is only streamed
+        self.assertFalse(did_update)
+        mock_download_unido_data.assert_not_called()
+        mock_config.resource_repository.add_or_update_resource_list.assert_not_called()
+        mock_get_data_version.assert_has_calls([call('INDSTAT', stream=True), call('IDSB', stream=True)])
+
+    @patch('collect_tasks.unido_collect.get_data_version', return_value='2024')  # Mock get_data_version
+    @patch('collect_tasks.unido_collect.download_unido_data')  # Mock download_unido_data
+    def test_unido_collect_no_previous_version(self, mock_download_unido_data, mock_get_data_version):
+        mock_config = self.make_config(Exception("No previous version"))
+
+        # Call the function
+        did_update = unido_collect(mock_config)
+
+        # Both resources are downloaded and registered with the online version
+        self.assertTrue(did_update)
+        mock_download_unido_data.assert_has_calls([
+            call('INDSTAT', 'collect/unido/INDSTAT/{version}'),
+            call('IDSB', 'collect/unido/IDSB/{version}')
+        ])
+        registered = [c.args[0] for c in mock_config.resource_repository.add_or_update_resource_list.call_args_list]
+        self.assertEqual([(r.name, r.data_version) for r in registered], [('INDSTAT', '2024'), ('IDSB', '2024')])
+        mock_get_data_version.assert_has_calls([call('INDSTAT', stream=False), call('IDSB', stream=False)])
+
+    @patch('collect_tasks.unido_collect.get_data_version', return_value='2024')  # Mock get_data_version
+    @patch('collect_tasks.unido_collect.download_unido_data')  # Mock download_unido_data
+    def test_unido_collect_failed_download(self, mock_download_unido_data, mock_get_data_version):
+        mock_config = self.make_config('2023')
+        def download(dataset, location):
+            if dataset == 'INDSTAT':
+                raise RuntimeError("1 data requests failed for dataset INDSTAT")
+        mock_download_unido_data.side_effect = download
+
+        # Call the function
+        did_update = unido_collect(mock_config)
+
+        # Only the complete download is registered
+        self.assertTrue(did_update)
+        registered = [c.args[0].name for c in mock_config.resource_repository.add_or_update_resource_list.call_args_list]
+        self.assertEqual(registered, ['IDSB'])
+
+
+if __name__ == '__main__':
+    unittest.main()
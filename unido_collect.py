@@ -1,11 +1,29 @@
 # Import packages
 import json
+import os
+from importlib.util import find_spec
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from logging import getLogger
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dataio.config import Config
 from templates import set_logger
+from ._http_cache import cached_get
+# orjson parses and serialises considerably faster, but the collector does not depend on it
+try:
+  import orjson
+except ImportError:
+  orjson = None
+# ijson can read single fields from a response while it downloads, but is optional as well
+try:
+  import ijson
+except ImportError:
+  ijson = None
 
 logger = getLogger('root')
 set_logger(
@@ -15,12 +33,116 @@ set_logger(
     create_path=True,
 )
 
+# Data requests in flight at once. The fan-out is bound by the round trips to stat.unido.org,
+# so it can be widened for large datasets.
+max_workers = int(os.environ.get('UNIDO_MAX_WORKERS', 16))
+# Keep a connection alive for every worker, otherwise urllib3 discards the surplus after each request
+max_connections = max(32, max_workers)
+request_timeout = 30
+data_timeout = 60
+# Output is written in large blocks, as a dataset can be several gigabytes
+write_buffer_size = 1 << 20
+metadata_url = 'https://stat.unido.org/portal/dataset/getDataset/{}'
+data_url = 'https://stat.unido.org/portal/dataset/getData'
+# Metadata responses are kept here and revalidated with conditional requests.
+cache_dir = os.environ.get('UNIDO_CACHE_DIR', 'unido_cache')
+# Request all variables of a country at once. The server has to support it, so it is opt-in
+# and falls back to one request per variable when the batched request is rejected.
+batch_variables = bool(os.environ.get('UNIDO_BATCH_VARIABLES'))
+# Shared session so connections to stat.unido.org are kept alive between requests.
+# Throttled and failed responses are retried with exponential backoff. The data
+# requests only read, so retrying them as POST is safe.
+session = requests.Session()
+session.mount('https://', HTTPAdapter(
+  pool_connections=16,
+  pool_maxsize=max_connections,
+  max_retries=Retry(
+    total=6,
+    backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["HEAD", "GET", "POST"],
+    respect_retry_after_header=True)))
+# The json responses compress well. urllib3 can only decode brotli when one of its packages is installed.
+accept_encoding = "gzip, br" if find_spec('brotli') or find_spec('brotlicffi') else "gzip"
+session.headers.update({"Accept-Encoding": accept_encoding, "Accept": "application/json"})
+
+
+# Parse a json response
+def load_json(content: bytes):
+
+  """
+    This function decodes a json response body, with orjson when it is installed.
+
+    Parameters
+    ----------
+    content : bytes
+      The json body of a response.
+
+    Returns
+    ----------
+    The decoded json data.
+
+  """
+
+  if orjson is not None:
+    # orjson reads the raw bytes, which skips decoding them to a str first
+    return orjson.loads(content)
+  return json.loads(content)
+
+
+# Serialise a json row
+def dump_json(data) -> bytes:
+
+  """
+    This function encodes data as compact json, with orjson when it is installed.
+
+    Parameters
+    ----------
+    data : dict or list
+      Data to encode.
+
+    Returns
+    ----------
+    UTF-8 encoded json data. Non-ASCII characters are kept as they are.
+
+  """
+
+  if orjson is not None:
+    return orjson.dumps(data)
+  return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+# Send a cached GET request
+def get_cached(url: str, name: str) -> bytes:
+
+  """
+    This function sends a GET request through the shared session. The response is cached
+    in cache_dir by cached_get, so an unchanged resource is read from the cache instead.
+
+    Parameters
+    ----------
+    url : str
+      The URL to request.
+    name : str
+      Name of the cache entry, used for the files in cache_dir.
+
+    Returns
+    ----------
+    The body of the response, or of the cached response if it is unchanged.
+
+  """
+
+  return cached_get(session, url, Path(cache_dir) / f"{name}.json", Path(cache_dir) / f"{name}.validators.json",
+                    timeout=request_timeout)
+
 
 # Optional step: Get metadata information for a dataset
+@lru_cache(maxsize=None)
 def get_metadata(dataset: str):
 
   """
     This function fetches and saves metadata information in json format.
+    The response is cached on disk by get_cached, so unchanged metadata is read from the cache.
 
     Parameters
     ------------
@@ -29,22 +151,164 @@ def get_metadata(dataset: str):
 
     Returns
     ------------
-    Json response data for the dataset.
+    Json response data for the dataset. The result is cached, so it must not be modified.
 
   """
 
   logger.info(f"Starting the process to request metadata for dataset: {dataset}")
 
   # Make a request for the dataset
-  dataset_url = 'https://stat.unido.org/portal/dataset/getDataset/{}'.format(dataset)
-  response = requests.get(dataset_url)
-  data = json.loads(response.text)
-  
+  data = load_json(get_cached(metadata_url.format(dataset), f"meta_{dataset}"))
+
   logger.info(f"Successfully retrieved metadata for {dataset}")
 
   return data
 
 
+# Post a data request
+def post_data(data: dict) -> list:
+
+  """
+    This function sends a data request and returns its rows. With ijson installed, the rows
+    are parsed while the response downloads, so the raw body is never held in memory.
+
+    Parameters
+    ----------
+    data : dict
+      Json body of the request.
+
+    Returns
+    ----------
+    List of dict with data values.
+
+  """
+
+  if ijson is not None:
+    with session.post(data_url, json=data, timeout=data_timeout, stream=True) as response:
+      # An error body has no rows, so it would otherwise pass as an empty result
+      response.raise_for_status()
+      # The raw stream is still compressed unless urllib3 is told to decode it
+      response.raw.decode_content = True
+      return list(ijson.items(response.raw, 'data.item', use_float=True))
+
+  response = session.post(data_url, json=data, timeout=data_timeout)
+  response.raise_for_status()
+  return load_json(response.content)['data']
+
+
+# Map over a thread pool with a bounded number of pending results
+def map_bounded(executor: ThreadPoolExecutor, fn, items):
+
+  """
+    This function works like executor.map, but only keeps a window of twice the number of
+    workers submitted at a time. A request stuck in retries then cannot make the results
+    of all later requests pile up in memory while they wait to be consumed in order.
+
+    Parameters
+    ----------
+    executor : ThreadPoolExecutor
+      The thread pool to run fn on.
+    fn : callable
+      Function called with each item.
+    items : iterable
+      The items to call fn with.
+
+    Returns
+    ----------
+    Iterator of the results of fn, in the order of the items.
+
+  """
+
+  pending = deque()
+  for item in items:
+    if len(pending) >= 2 * max_workers:
+      yield pending.popleft().result()
+    pending.append(executor.submit(fn, item))
+  while pending:
+    yield pending.popleft().result()
+
+
+# Get data values for a single country and variable
+def get_country_variable_values(base: dict, cc: str, vc: str):
+
+  """
+    This function fetches the data values of one country and variable.
+
+    Parameters
+    ----------
+    base : dict
+      Request fields shared by all requests of the dataset: datasetId, activityCodes and periods.
+    cc : str
+      Code of the country.
+    vc : str
+      Code of the variable.
+
+    Returns
+    ----------
+    List of dict with data values, tagged with the country and variable code,
+    or None if the request failed.
+
+  """
+
+  # One pair of messages per request would flood the log at INFO, so they are DEBUG and formatted lazily
+  logger.debug("Starting process for country: %s, variable: %s", cc, vc)
+  data = {**base, "countryCode": cc, "variableCode": vc}
+  # A request that still fails after its retries must not stop the other requests
+  try:
+    json_result = post_data(data)
+  except Exception as e:
+    logger.error(f"Failed to retrieve data for country: {cc}, variable: {vc}: {e}")
+    return None
+  for i in json_result:
+    i['cc'] = cc
+    i['vc'] = vc
+  logger.debug("Finished process for country: %s, variable: %s", cc, vc)
+
+  return json_result
+
+
+# Get data values for a single country and all variables
+def get_country_values(base: dict, cc: str, variables: list):
+
+  """
+    This function fetches the data values of one country for several variables in one request.
+
+    Parameters
+    ----------
+    base : dict
+      Request fields shared by all requests of the dataset: datasetId, activityCodes and periods.
+    cc : str
+      Code of the country.
+    variables : list
+      List of the variables to include.
+
+    Returns
+    ----------
+    List of dict with data values, tagged with the country and variable code,
+    or None if the server does not accept a list of variables.
+
+  """
+
+  logger.info(f"Starting process for country: {cc}, all variables")
+  data = {**base, "countryCode": cc, "variableCodes": variables}
+  try:
+    response = session.post(data_url, json=data, timeout=data_timeout)
+    json_result = load_json(response.content).get('data') if response.ok else None
+  except Exception as e:
+    logger.error(f"Failed to retrieve data for country: {cc}, all variables: {e}")
+    json_result = None
+  # Without the variable code on each row, the rows cannot be told apart
+  if json_result is None or any('variableCode' not in i for i in json_result):
+    logger.warning(f"Batched request rejected for country: {cc}, requesting one variable at a time")
+    return None
+  for i in json_result:
+    i['cc'] = cc
+    i['vc'] = i['variableCode']
+  logger.info(f"Finished process for country: {cc}, all variables")
+
+  return json_result
+
+
 # Optional step: Get data values for specific parameters
 def get_data_values(dataset: str, activities: list, countries: list, variables: list, periods: list):
   
@@ -70,39 +334,102 @@ def get_data_values(dataset: str, activities: list, countries: list, variables:
 
   """
 
-  meta_data = get_metadata(dataset)
-  dataset_id = meta_data['id']
-
-  logger.info(f"Starting the process to request data")
-
-  data_url = 'https://stat.unido.org/portal/dataset/getData'
   all_data = []
-  for cc in countries:
-    logger.info(f"Starting process for country: {cc}")
-    for vc in variables:
-      logger.info(f"Starting process for variable: {vc}")
-      data = {
-      "datasetId": dataset_id,
-      "countryCode": cc,
-      "variableCode": vc,
-      "activityCodes": activities,
-      "periods": periods
-      }
-      response = requests.post(data_url, json=data)
-      json_result = json.loads(response.text)['data']
-      for i in json_result:
-          i.update({'cc': cc, 'vc': vc})
-          all_data.append(i)
-      logger.info(f"Finished process for variable: {vc}")  
-    logger.info(f"Finished process for country: {cc}")
-  
+  for rows in get_data_values_from_meta(get_metadata(dataset), activities, countries, variables, periods):
+    all_data.extend(rows)
+
   logger.info(f"Successfully retrieved data for {dataset}")
 
   return all_data
 
 
+# Get data values for specific parameters from already fetched metadata
+def get_data_values_from_meta(meta_data: dict, activities: list, countries: list, variables: list, periods: list):
+
+  """
+    This function fetches the data values of a dataset whose metadata is already known.
+    The rows of each response are yielded as they arrive, so they do not all have to be held in memory.
+
+    Parameters
+    ----------
+    meta_data : dict
+      Metadata of the dataset, as returned by get_metadata.
+    activities : list
+      List of the activities to include.
+    countries : list
+      List of the countries to include.
+    variables : list
+      List of the variables to include.
+    periods : list
+      List of the years to include.
+
+    Returns
+    ----------
+    Iterator of lists of dict with data values, one list per response.
+
+    Raises
+    ----------
+    RuntimeError
+      Once all requests are done, if any of them failed, so the incomplete data is not used as complete.
+
+  """
+
+  # The requests only differ in their country and variable, so the other fields are set once.
+  # Each request copies them, as the requests are sent from several threads.
+  base = {"datasetId": meta_data['id'], "activityCodes": activities, "periods": periods}
+
+  logger.info(f"Starting the process to request data")
+
+  tasks = [(cc, vc) for cc in countries for vc in variables]
+  # Probe the batched form with the first country before relying on it
+  first_rows = None
+  if batch_variables and countries:
+    first_rows = get_country_values(base, countries[0], variables)
+    # A server that ignores the list of variables can answer with no rows at all, so the
+    # batched form is only used once the probe returns rows for every variable
+    if first_rows is not None and not set(variables).issubset(i['variableCode'] for i in first_rows):
+      logger.warning(f"Batched request incomplete for country: {countries[0]}, requesting one variable at a time")
+      first_rows = None
+
+  # The requests only wait on the network, so they are sent from a thread pool.
+  # The results come back in task order, keeping the rows in the original order.
+  failed = 0
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    if first_rows is None:
+      # The tasks are in country order, so the progress is logged at INFO whenever the country changes
+      country = None
+      for (cc, vc), rows in zip(tasks, map_bounded(executor, lambda task: get_country_variable_values(base, *task), tasks)):
+        if cc != country:
+          if country is not None:
+            logger.info(f"Finished process for country: {country}")
+          logger.info(f"Starting process for country: {cc}")
+          country = cc
+        if rows is None:
+          failed += 1
+        else:
+          yield rows
+      if country is not None:
+        logger.info(f"Finished process for country: {country}")
+    else:
+      yield first_rows
+      other_countries = countries[1:]
+      for cc, rows in zip(other_countries, map_bounded(executor, lambda cc: get_country_values(base, cc, variables), other_countries)):
+        if rows is None:
+          for vc_rows in map_bounded(executor, lambda vc: get_country_variable_values(base, cc, vc), variables):
+            if vc_rows is None:
+              failed += 1
+            else:
+              yield vc_rows
+          logger.info(f"Finished process for country: {cc}")
+        else:
+          yield rows
+
+  if failed:
+    raise RuntimeError(f"{failed} data requests failed for dataset {meta_data['id']}")
+
+
 # Get data version
-def get_data_version(dataset:str):
+def get_data_version(dataset:str, stream: bool = False):
   """
     This function extracts the production year of the data.
 
@@ -110,6 +437,10 @@ def get_data_version(dataset:str):
     ----------
     Dataset : str
       Name of the dataset.
+    stream : bool, optional
+      Read only the production year while the metadata downloads, instead of fetching the
+      whole metadata through get_metadata. Only worth it when the metadata is unlikely to be
+      needed afterwards, as a download would then fetch it a second time.
 
     Returns
     -------
@@ -117,6 +448,16 @@ def get_data_version(dataset:str):
 
   """
 
+  # Without a cached copy of the metadata, read only the production year from the
+  # response and stop downloading the countries, activities and variables after it
+  if stream and ijson is not None and not (Path(cache_dir) / f"meta_{dataset}.json").exists():
+    with session.get(metadata_url.format(dataset), timeout=request_timeout, stream=True) as response:
+      if response.status_code == 200:
+        # The raw stream is still compressed unless urllib3 is told to decode it
+        response.raw.decode_content = True
+        for production_year in ijson.items(response.raw, 'production_year'):
+          return production_year
+
   data = get_metadata(dataset)
   return data['production_year']
 
@@ -142,20 +483,27 @@ def download_unido_data(dataset:str, save_directory:str):
   """
   directory_path = Path(save_directory)
   data = get_metadata(dataset)
-  countries = []
   periods = data['periods']
-  activities = []
-  variables = []
-  for i in data['countries']:
-      countries.append(i['c'])
-  for i in data['activities']:
-      activities.append(i['c'])
-  for i in data['variables']:
-      variables.append(i['c'])
-  result = get_data_values(dataset, activities, countries, variables, periods)
-
-  with open('{}/fact_{}.json'.format(directory_path, dataset), 'w', encoding='utf-8') as f:
-    json.dump(result, f, ensure_ascii=False, indent=4)
+  countries = [i['c'] for i in data['countries']]
+  activities = [i['c'] for i in data['activities']]
+  variables = [i['c'] for i in data['variables']]
+  result = get_data_values_from_meta(data, activities, countries, variables, periods)
+
+  # Write the rows as they arrive instead of collecting the whole dataset first.
+  # They go to a partial file that only replaces the output once it is complete,
+  # so a failed request leaves the partial file behind and the output untouched.
+  file_path = directory_path / f"fact_{dataset}.json"
+  partial_path = file_path.with_name(file_path.name + '.part')
+  with open(partial_path, 'wb', buffering=write_buffer_size) as f:
+    f.write(b'[')
+    separator = b''
+    for rows in result:
+      if rows:
+        # Encode each response in one call and drop the brackets of its list
+        f.write(separator + dump_json(rows)[1:-1])
+        separator = b','
+    f.write(b']')
+  os.replace(partial_path, file_path)
 
   logger.info(f"Dataset {dataset} successfully downloaded and saved to {save_directory}")
 
@@ -190,27 +538,36 @@ def unido_collect(config: Config) -> bool:
 
   did_update = False
 
+  # Fetch the metadata anew on every run, then share it between the version check and the download
+  get_metadata.cache_clear()
+
   for resource in required_resources:
-    online_version = get_data_version(resource.name)
     try:
       latest_version = repo.get_latest_version(name=resource.name, stage=resource.stage, task_name=resource.task_name)
-    except:
+    except Exception as e:
+      # A resource that was never collected has no latest version
+      logger.warning(f"No latest version of {resource.name} found, downloading it: {e}")
       latest_version = None
-    
-    if latest_version:
-      if latest_version != online_version:
-        resource.data_version = online_version
-        download_unido_data(resource.name, resource.location)
-        repo.add_or_update_resource_list(resource)
-        did_update = True
-    else:
-      if online_version:
-        resource.data_version = online_version
-      else:
-        resource.data_version = "YYYY"
+
+    # A resource that was never collected is downloaded anyway, so its version is read from
+    # the metadata the download uses. Otherwise it is most likely unchanged and only the
+    # production year is read.
+    online_version = get_data_version(resource.name, stream=latest_version is not None)
+
+    # Skip the download when the collected version is still the online one
+    if latest_version and latest_version == online_version:
+      logger.info(f"Dataset {resource.name} is up to date at version {latest_version}")
+      continue
+
+    resource.data_version = online_version if online_version else "YYYY"
+    # An incomplete download is not registered, so the next run tries it again
+    try:
       download_unido_data(resource.name, resource.location)
-      repo.add_or_update_resource_list(resource)
-      did_update = True
+    except Exception as e:
+      logger.error(f"Failed to download dataset {resource.name}: {e}")
+      continue
+    repo.add_or_update_resource_list(resource)
+    did_update = True
 
   return did_update
    
\ No newline at end of file